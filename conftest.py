@@ -0,0 +1,12 @@
+import os
+import pytest
+from snakehelp.config import set_data_folder
+
+
+@pytest.fixture
+def data_folder(tmp_path):
+    """Sets the data folder to a temporary folder during the test. Yields the data folder (ending with a path separator)"""
+    folder = str(tmp_path / "data") + os.path.sep
+    set_data_folder(folder)
+    yield folder
+    set_data_folder("")
@@ -4,7 +4,7 @@
 
 from setuptools import setup, find_packages
 
-requirements = ["pandas", "numpy", "pathos", "shared_memory_wrapper", "kaleido", "plotly", "tabulate"]
+requirements = ["pandas", "numpy", "pathos", "kaleido", "plotly", "tabulate", "typer", "pyyaml"]
 
 test_requirements = ['pytest>=3', "hypothesis"]
 
@@ -22,6 +22,10 @@ setup(
     description="Snakehelp: Making snakemake easier to use.",
     long_description="Snakehelp",
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow"], "watch": ["inotify_simple"]},
+    entry_points={
+        "console_scripts": ["snakehelp=snakehelp.cli:main"],
+    },
     license="MIT license",
     include_package_data=True,
     keywords='snakehelp',
@@ -5,4 +5,5 @@ __email__ = 'ivar.grytten@gmail.com'
 __version__ = '0.0.20'
 
 from .parameters import parameters, result, ResultLike
-from .config import set_data_folder, get_data_folder
+from .registry import registered_classes, wildcard_constraints, wildcard_constraints_block
+from .config import set_data_folder, get_data_folder, set_result_store, get_result_store
@@ -1,19 +1,264 @@
 """Console script for snakehelp."""
-# todo
+import contextlib
+import dataclasses
+import os
+import sys
+from typing import List
+import typer
 
+app = typer.Typer()
 
-import typer
 
+@app.callback()
+def callback():
+    """
+    Snakehelp: Making snakemake easier to use.
+    """
 
-def main():
-    '''
-    Simple function
 
-    >>> main()
+def _find_class(classes, name):
+    matches = [cls for cls in classes if cls.__name__ == name]
+    assert len(matches) == 1, f"Found no class {name}. Available classes are {[cls.__name__ for cls in classes]}"
+    return matches[0]
+
+
+def _parse_params(parameter_type, params):
+    """
+    Parses --param name=value1,value2 options into a dict from parameter name to a list of values,
+    converted to the type of the parameter in parameter_type.
+    """
+    from .path_parser import coercer
+
+    types = {field.name: field.type for field in parameter_type.get_fields()}
+    data = {}
+    for param in params:
+        assert "=" in param, f"Invalid parameter {param}. Must be on the form name=value1,value2,..."
+        name, values = param.split("=", 1)
+        assert name in types, f"{name} is not a parameter of {parameter_type.__name__}. Valid parameters are {list(types)}"
+        coerce = coercer(types[name])
+        data[name] = [coerce(value) for value in values.split(",")]
+    return data
+
+
+@contextlib.contextmanager
+def _profiled(enabled):
+    """Runs the block with cProfile if enabled, and prints the most expensive calls to stderr"""
+    if not enabled:
+        yield
+        return
+
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+
+
+SOURCE_HELP = "Python file defining the @parameters and @result classes"
+PARAM_HELP = "Values for a parameter, as name=value1,value2. Can be given multiple times"
+PROFILE_HELP = "Profile the command and print the most expensive calls to stderr"
+WORKERS_HELP = "Number of workers used to read result files"
+SHARD_HELP = "Only use the combinations in one shard, given as index/count (e.g. 0/4)"
+
+
+def _write_table(df, output):
+    assert output is None or output.endswith((".parquet", ".csv")), f"Output must be a .parquet or .csv file, not {output}"
+    if output is None:
+        df.to_csv(sys.stdout, index=False)
+    elif output.endswith(".parquet"):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+
+def _read_table(file_name):
+    import pandas as pd
+    assert file_name.endswith((".parquet", ".csv")), f"Can only read .parquet or .csv files, not {file_name}"
+    if file_name.endswith(".parquet"):
+        return pd.read_parquet(file_name)
+    return pd.read_csv(file_name)
+
+
+@app.command()
+def codegen(
+        source: str = typer.Argument(..., help=SOURCE_HELP),
+        output: str = typer.Option(None, "--output", "-o", help="File to write to (stdout if not given)"),
+        data_folder: str = typer.Option(None, help="Data folder to prefix all paths with"),
+        profile: bool = typer.Option(False, help=PROFILE_HELP),
+):
+    """
+    Generates a Snakefile to include, with global wildcard constraints and static
+    input/output patterns (<Name>_input and <Name>_output) for every class in SOURCE.
+    """
+    from .codegen import load_classes, generate_snakefile
+    from .config import set_data_folder
+
+    if data_folder is not None:
+        set_data_folder(data_folder)
+    with _profiled(profile):
+        code = generate_snakefile(load_classes(source), header=source)
+    if output is None:
+        typer.echo(code, nl=False)
+    else:
+        with open(output, "w") as f:
+            f.write(code)
+
 
-    '''
-    return
+@app.command()
+def targets(
+        source: str = typer.Argument(..., help=SOURCE_HELP),
+        class_name: str = typer.Argument(..., help="Name of the class to give paths for"),
+        params: List[str] = typer.Option([], "--param", "-p", help=PARAM_HELP),
+        output: str = typer.Option(None, "--output", "-o", help="File to write to (stdout if not given)"),
+        data_folder: str = typer.Option(None, help="Data folder to prefix all paths with"),
+        shard: str = typer.Option(None, help=SHARD_HELP),
+        workers: int = typer.Option(1, help="Not used, paths are streamed from one process. Accepted like for the other commands"),
+        profile: bool = typer.Option(False, help=PROFILE_HELP),
+):
+    """
+    Writes one path per line for every combination of the given parameter values, with defaults
+    for the other parameters. Paths are streamed, so large grids are never held in memory.
+    The paths can be given as targets to snakemake, e.g. with --batch.
+    With --shard, each node can get its own part of the grid.
+    """
+    from .codegen import load_classes
+    from .config import set_data_folder
+
+    if data_folder is not None:
+        set_data_folder(data_folder)
+    cls = _find_class(load_classes(source), class_name)
+    data = _parse_params(cls, params)
+    for field in cls.get_fields():
+        if field.name not in data:
+            assert not isinstance(field.default, dataclasses._MISSING_TYPE), \
+                f"Parameter {field.name} of {class_name} has no default value. Give it with --param {field.name}=..."
+            data[field.name] = field.default
+
+    with _profiled(profile):
+        with (contextlib.nullcontext(sys.stdout) if output is None else open(output, "w")) as f:
+            for path in cls.iter_output(_shard=shard, **data):
+                f.write(path + "\n")
+
+
+@app.command()
+def collect(
+        source: str = typer.Argument(..., help=SOURCE_HELP),
+        result_names: List[str] = typer.Argument(..., help="Names of the @result classes to collect"),
+        params: List[str] = typer.Option([], "--param", "-p", help=PARAM_HELP),
+        output: str = typer.Option(None, "--output", "-o", help="A .parquet or .csv file to write to (csv to stdout if not given)"),
+        grid: bool = typer.Option(False, help="Read the result for every combination of the given parameters instead of scanning the data folder"),
+        data_folder: str = typer.Option(None, help="Data folder to read results from"),
+        shard: str = typer.Option(None, help=SHARD_HELP),
+        workers: int = typer.Option(1, help=WORKERS_HELP),
+        profile: bool = typer.Option(False, help=PROFILE_HELP),
+):
+    """
+    Collects results into a table with one column per parameter and one per result.
+    By default the data folder is scanned once for the results that exist, keeping only those matching
+    the given parameters. With --grid, results are read for every combination of the given parameters
+    (defaults are used for other parameters) and missing results are an error.
+    With --shard, only the results in one shard are collected. Use merge to combine the tables of all shards.
+    """
+    from .codegen import load_classes
+    from .config import set_data_folder
+    from .parameter_combinations import ParameterCombinations
+    from .sharding import parse_shard
+
+    if data_folder is not None:
+        set_data_folder(data_folder)
+    classes = load_classes(source)
+    result_types = [_find_class(classes, name) for name in result_names]
+    data = _parse_params(result_types[0], params)
+
+    with _profiled(profile):
+        combinations = ParameterCombinations(list(data), result_types, workers=workers)
+        if shard is not None:
+            combinations = combinations.shard(*parse_shard(shard))
+        if grid:
+            df = combinations.get_results_dataframe(**data)
+        else:
+            df = combinations.scan_results_dataframe(**data)
+
+        _write_table(df, output)
+
+
+@app.command()
+def merge(
+        shard_files: List[str] = typer.Argument(..., help="Tables (.parquet or .csv) written by collect --shard"),
+        output: str = typer.Option(None, "--output", "-o", help="A .parquet or .csv file to write to (csv to stdout if not given)"),
+        profile: bool = typer.Option(False, help=PROFILE_HELP),
+):
+    """
+    Concatenates the tables collected for each shard into one table.
+    """
+    from .sharding import merge_shards
+    with _profiled(profile):
+        _write_table(merge_shards(_read_table(file_name) for file_name in shard_files), output)
+
+
+@app.command()
+def plot(
+        source: str = typer.Argument(..., help=SOURCE_HELP),
+        config_file: str = typer.Argument(..., help="YAML file with plot_types and plots"),
+        plot_names: List[str] = typer.Argument(None, help="Names of plots to make (all plots in the config if not given)"),
+        out_folder: str = typer.Option("plots", help="Folder to write the plots to"),
+        force: bool = typer.Option(False, help="Write plots even if their data has not changed"),
+        report: str = typer.Option(None, help="Write all plots to this single HTML file instead of one set of files per plot"),
+        data_folder: str = typer.Option(None, help="Data folder to read results from"),
+        workers: int = typer.Option(1, help=WORKERS_HELP),
+        profile: bool = typer.Option(False, help=PROFILE_HELP),
+):
+    """
+    Makes plots from a YAML config. The config has a dict plot_types, where each plot type has the fields
+    of a PlotType (result dimensions are given by the name of the @result class), and a dict plots where
+    each plot has a plot_type and values for parameters. Each plot is written to OUT_FOLDER/<name>.{csv,txt,png,html}.
+    Every result file is read once, and with --workers the figures are rendered in parallel processes.
+    With --report, all plots are written to one HTML file.
+    """
+    import yaml
+    from .codegen import load_classes
+    from .config import set_data_folder
+    from .plotting import PlotType, render_plots
+
+    if data_folder is not None:
+        set_data_folder(data_folder)
+    classes = load_classes(source)
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+
+    plot_types = {name: PlotType.from_yaml_dict(spec, classes) for name, spec in config["plot_types"].items()}
+    plots = config["plots"]
+    if not plot_names:
+        plot_names = list(plots)
+
+    specs = []
+    for name in plot_names:
+        assert name in plots, f"Plot {name} is not in {config_file}. Available plots are {list(plots)}"
+        data = dict(plots[name])
+        plot_type = data.pop("plot_type")
+        assert plot_type in plot_types, f"Plot type {plot_type} used by plot {name} is not among the plot types {list(plot_types)}"
+        specs.append((plot_types[plot_type], os.path.join(out_folder, name), data))
+
+    if report is not None:
+        from .report import write_report
+        with _profiled(profile):
+            write_report(specs, report, title=os.path.basename(config_file), workers=workers)
+        typer.echo(f"Wrote {len(specs)} plot(s) to {report}", err=True)
+        return
+
+    os.makedirs(out_folder, exist_ok=True)
+    with _profiled(profile):
+        _, rendered = render_plots(specs, workers=workers, headless=True, force=force)
+    typer.echo(f"Wrote {sum(rendered)} plot(s) to {out_folder}, {len(rendered) - sum(rendered)} were up to date", err=True)
+
+
+def main():
+    app()
 
 
 if __name__ == "__main__":
-    typer.run(main)
+    main()
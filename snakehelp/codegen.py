@@ -0,0 +1,45 @@
+"""
+Generates Snakefile code with static input and output patterns for @parameters classes,
+so that rules can use plain patterns instead of input functions from as_input().
+"""
+import runpy
+from .config import get_data_folder
+from .parameters import pattern
+from .registry import registered_classes, wildcard_constraints, wildcard_constraints_block
+
+
+def load_classes(source):
+    """
+    Runs a Python file and returns the @parameters and @result classes it defines or imports,
+    in the order they were defined.
+    """
+    namespace = runpy.run_path(source)
+    classes = [obj for obj in namespace.values() if isinstance(obj, type) and hasattr(obj, "schema")]
+    order = {cls: i for i, cls in enumerate(registered_classes())}
+    return sorted(classes, key=lambda cls: order.get(cls, len(order)))
+
+
+def generate_snakefile(classes=None, header=None):
+    """
+    Returns Snakefile code with a global wildcard_constraints block for the classes (all registered classes
+    by default) and two variables for each class:
+
+    <Name>_input: the path with plain wildcards, e.g. {seed}/{name}.txt. Snakemake fills in the wildcards
+    from the output of the rule, which gives the same path as <Name>.as_input() without calling Python for every job.
+    <Name>_output: the path for use as output, with inline regexes only for wildcards that could
+    not be constrained globally.
+    """
+    if classes is None:
+        classes = registered_classes()
+
+    constraints = wildcard_constraints(classes)
+    lines = [
+        "# Generated by snakehelp" + ("" if header is None else " from " + header) + ". Do not edit.",
+        f"# Data folder: {get_data_folder()!r}",
+        "",
+        wildcard_constraints_block(classes),
+    ]
+    for cls in classes:
+        lines.append(f"{cls.__name__}_input = {pattern(cls)!r}")
+        lines.append(f"{cls.__name__}_output = {pattern(cls, constraints)!r}")
+    return "\n".join(lines) + "\n"
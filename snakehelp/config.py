@@ -1,4 +1,5 @@
 _data_folder = ""
+_result_store = None
 
 def set_data_folder(folder):
     global _data_folder
@@ -7,3 +8,14 @@ def set_data_folder(folder):
 
 def get_data_folder():
     return _data_folder
+
+
+def set_result_store(store):
+    """Sets a store (e.g. a ParquetResultStore) that results are written to and read from
+    instead of one file per result. Set to None to use files again."""
+    global _result_store
+    _result_store = store
+
+
+def get_result_store():
+    return _result_store
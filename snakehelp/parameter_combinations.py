@@ -1,6 +1,18 @@
+import contextlib
+import dataclasses
 import itertools
-import pandas as pd
-from snakehelp.parameters import ParameterLike
+import numbers
+import os
+import warnings
+from typing import get_origin, get_args, Literal, Union
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from snakehelp.parameters import ParameterLike, read_result
+from snakehelp.config import get_result_store, get_data_folder
+from snakehelp.snakehelp import is_parameter_type
+from snakehelp.result_index import ResultIndex
+from snakehelp.path_parser import scan_many
+from snakehelp.sharding import parse_shard, shard_of, shard_mask
+# pandas is imported inside the methods that need it, so that importing snakehelp stays fast in Snakemake jobs
 
 
 def at_least_list(element):
@@ -9,13 +21,174 @@ def at_least_list(element):
     return [element]
 
 
+class ResultFetchError(FileNotFoundError):
+    """Raised after fetching results when one or more results could not be read.
+    errors is a dict from file name to the exception raised when reading it.
+    Subclasses FileNotFoundError, which was raised before results were fetched together."""
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Could not read {len(errors)} result file(s):\n" +
+                         "\n".join(f"{file}: {error!r}" for file, error in errors.items()))
+
+
+def _report_errors(failed, errors):
+    if len(failed) > 0:
+        if errors == "raise":
+            raise ResultFetchError(failed)
+        elif errors == "warn":
+            warnings.warn(str(ResultFetchError(failed)))
+
+
+def _try_read_result(file_name):
+    try:
+        return read_result(file_name), None
+    except Exception as e:
+        return None, e
+
+
+def fetch_results(files, workers=1, executor="thread", cache=None):
+    """
+    Reads the results in files, using a thread pool (executor="thread") or process pool (executor="process")
+    if workers > 1. Returns a list of values in the same order as files, and a dict from file name to exception
+    for the files that could not be read (their value is None).
+
+    cache can be a dict from file name to value. Files in the cache are not read, and the values
+    of files that are read are added to it.
+    """
+    assert executor in ("thread", "process"), f"Invalid executor {executor}. Must be thread or process"
+    if cache is not None:
+        missing = list(dict.fromkeys(file for file in files if file not in cache))
+        values, errors = fetch_results(missing, workers, executor)
+        cache.update((file, value) for file, value in zip(missing, values) if file not in errors)
+        return [cache.get(file) for file in files], {file: errors[file] for file in files if file in errors}
+
+    if workers is None or workers <= 1:
+        fetched = [_try_read_result(file) for file in files]
+    else:
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            # chunksize is only used by process pools, where it cuts down on inter-process communication
+            fetched = list(pool.map(_try_read_result, files, chunksize=64))
+
+    values = [value for value, _ in fetched]
+    errors = {file: error for file, (_, error) in zip(files, fetched) if error is not None}
+    return values, errors
+
+
+def _object_array(values):
+    import numpy as np
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def _to_arrow(df):
+    import pyarrow as pa
+    # Categorical columns become dictionary encoded arrays
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def typed_column(values, type):
+    """
+    Returns the values of a parameter as a compact column: a Categorical for str and Literal parameters
+    (with the Literal values as categories) and int64 or float64 NumPy arrays for int and float parameters.
+    Other values, and values of int parameters that are not all integers, are returned as an object array.
+    Categories that are not given by a Literal are kept in the order they first appear in, so that plots keep
+    the order of the given parameter values.
+
+    >>> list(typed_column(["b", "a", "b"], str).categories)
+    ['b', 'a']
+    >>> typed_column([1, 1.5], int).tolist()
+    [1, 1.5]
+    """
+    import numpy as np
+    import pandas as pd
+    if type == int:
+        if pd.api.types.infer_dtype(values, skipna=False) == "integer":
+            return np.asarray(values, dtype=np.int64)
+    elif type == float:
+        return np.asarray(values, dtype=np.float64)
+    elif type == str:
+        return pd.Categorical(values, categories=list(dict.fromkeys(values)))
+    elif get_origin(type) == Literal:
+        categories = list(dict.fromkeys(get_args(type)))
+        if not set(values) <= set(categories):
+            categories = list(dict.fromkeys(values))
+        return pd.Categorical(values, categories=categories)
+    return pd.Series(values, dtype=object).to_numpy()
+
+
+def result_column(values):
+    """Returns the result values as a float64 array if they are all numbers (or missing), otherwise as an object array"""
+    import numpy as np
+    import pandas as pd
+    values = list(values)
+    if all(value is None or (isinstance(value, numbers.Real) and not isinstance(value, bool)) for value in values):
+        return np.array(values, dtype=np.float64)
+    return pd.Series(values, dtype=object).to_numpy()
+
+
+# options for how results are read, given to ParameterCombinations and not together with the data,
+# so that parameters can have any name
+DEFAULT_OPTIONS = {
+    "workers": 1, "executor": "thread", "errors": "raise", "index": None, "cache": None, "arrow": False,
+    "interval": 1.0, "timeout": None, "use_inotify": None,
+}
+
+
 class ParameterCombinations:
-    def __init__(self, parameter_names, result_types):
+    """
+    Gives the combinations of parameters, and the results, of result_types for the data given to its methods.
+
+    Keyword options decide how results are read (use with_options to change them):
+    workers and executor: results are read concurrently when workers > 1, with threads (executor="thread")
+    or processes (executor="process").
+    errors: all results are attempted before errors are reported. With errors="raise", a ResultFetchError
+    listing every file that failed is raised. With errors="warn", failed results are NaN and a warning is given.
+    index: a ResultIndex (or a path to one). Then only result files that have changed since they were
+    indexed are read, everything else is answered by the index.
+    cache: a dict from file name to value that is shared between calls (see fetch_results),
+    so that results used by many dataframes are only read once.
+    arrow: if True, pyarrow Tables are returned instead of Pandas Dataframes.
+    interval, timeout and use_inotify: used by watch.
+    """
+    def __init__(self, parameter_names, result_types, **options):
         self.parameter_names = parameter_names
         self.result_types = result_types
+        self._shard = None
 
         assert all([isinstance(t, str) for t in parameter_names]), "All parameter names must be strings"
         assert all([issubclass(t, ParameterLike) for t in result_types]), "All result types must be classes that are ParameterLike: %s" % result_types
+        for name in options:
+            assert name in DEFAULT_OPTIONS, f"Invalid option {name}. Valid options are {list(DEFAULT_OPTIONS)}"
+        self.options = {**DEFAULT_OPTIONS, **options}
+        assert self.options["errors"] in ("raise", "warn"), f"Invalid value for errors: {self.options['errors']}. Must be raise or warn"
+
+    def with_options(self, **options):
+        """Returns ParameterCombinations with the same parameters and shard, where the given options are changed"""
+        combinations = ParameterCombinations(self.parameter_names, self.result_types, **{**self.options, **options})
+        combinations._shard = self._shard
+        return combinations
+
+    def shard(self, index, count):
+        """
+        Returns ParameterCombinations that only gives the combinations in shard index of count shards.
+        Which shard a combination is in only depends on its flat parameters (see snakehelp.sharding.shard_of),
+        so count nodes each using their own index together cover every combination exactly once,
+        no matter the order of the data given.
+        """
+        sharded = self.with_options()
+        sharded._shard = parse_shard((index, count))
+        return sharded
+
+    def _in_shard(self, flat_data):
+        return self._shard is None or shard_of(self.result_types[0].parameters, flat_data, self._shard[1]) == self._shard[0]
+
+    def _filter_shard(self, df):
+        if self._shard is None:
+            return df
+        return df[shard_mask(df, self.result_types[0].parameters, *self._shard)].reset_index(drop=True)
 
     def combinations(self, **data):
         """
@@ -23,48 +196,352 @@ class ParameterCombinations:
 
         Returna nested list. Eachs sublist contains all objects for a given set of parameters.
         """
+        return list(self.iter_combinations(**data))
+
+    def iter_combinations(self, **data):
+        """
+        Same as combinations, but lazily yields one list of objects (one for each result type)
+        for every combination of parameters.
+        """
         # wrap every data value in list and combine them
         data = {key: at_least_list(value) for key, value in data.items()}
-        values = data.values()
-        combinations = itertools.product(*values)
-        combination_dicts = [
-            {key: value for key, value in zip(data.keys(), combination)}
-            for combination in combinations
-        ]
-
-        objects = []
-        for combination in combination_dicts:
-            row = []
-            for result_type in self.result_types:
-                row.append(result_type.from_flat_params(**combination))
-            objects.append(row)
-
-        return objects
+        keys = list(data.keys())
+        for combination in itertools.product(*data.values()):
+            combination = dict(zip(keys, combination))
+            objects = [result_type.from_flat_params(**combination) for result_type in self.result_types]
+            if self._in_shard(objects[0].flat_data()):
+                yield objects
+
+    def supports_grid(self):
+        """
+        Returns True if the grid can be built without creating objects, which is the case
+        when no result type has Union fields with @parameters types.
+        """
+        return all(
+            not (get_origin(field.type) == Union and any(is_parameter_type(t) for t in get_args(field.type)))
+            for result_type in self.result_types for field in result_type.get_fields()
+        )
+
+    def grid(self, **data):
+        """
+        Returns the same combinations as combinations(), but as a Pandas Dataframe with one column for
+        every flat parameter and a column <ResultName>_file with the file path of every result type.
+
+        The grid is built with a vectorized cross join and the paths with vectorized string
+        concatenation, without creating any objects.
+        """
+        import pandas as pd
+        assert self.supports_grid(), "Grid does not support Union fields with @parameters types. Use combinations()"
+        import numpy as np
+        data = {key: at_least_list(value) for key, value in data.items()}
+        # the product is built from integer codes into the given values, so that values and their strings
+        # are exactly as given (pandas would e.g. turn [1, 1.5] into [1.0, 1.5], giving other paths than file_path())
+        sizes = [len(values) for values in data.values()]
+        n_rows = int(np.prod(sizes))
+        columns = {}
+        string_columns = {}
+        for i, (name, values) in enumerate(data.items()):
+            codes = np.tile(np.repeat(np.arange(sizes[i]), int(np.prod(sizes[i + 1:]))), int(np.prod(sizes[:i])))
+            columns[name] = pd.Series(_object_array(values)[codes], dtype=object)
+            string_columns[name] = pd.Series(_object_array([str(v) for v in values])[codes], dtype=object)
+
+        grid = pd.DataFrame(index=range(n_rows))
+        for result_type in self.result_types:
+            path_parts = []
+            for field in result_type.get_fields():
+                if field.name in columns:
+                    column = columns[field.name]
+                    path_parts.append(string_columns[field.name])
+                else:
+                    assert not isinstance(field.default, dataclasses._MISSING_TYPE), \
+                        f"Field {field.name} in class {result_type} does not have a default value " \
+                        f"set and no value was provided for it."
+                    column = field.default
+                    path_parts.append(str(column))
+
+                if field.name not in grid:
+                    grid[field.name] = column
+
+            if result_type.file_name is not None:
+                path_parts.append(result_type.file_name)
+
+            path = path_parts[0]
+            for part in path_parts[1:]:
+                path = path + os.path.sep + part
+            path = get_data_folder() + path + result_type.file_ending
+            grid[result_type.__name__ + "_file"] = path
+
+        return self._filter_shard(grid)
 
     def get_files(self, **data):
         """
         Returns the necessary files for getting the given data.
         """
-        combinations = self.combinations(**data)
-        files = [o.file_path() for o in itertools.chain(*combinations)]
-        return files
+        if self.supports_grid():
+            grid = self.grid(**data)
+            return grid[[result_type.__name__ + "_file" for result_type in self.result_types]].to_numpy().ravel().tolist()
+        return list(self.iter_files(**data))
+
+    def iter_files(self, **data):
+        """
+        Lazily yields the necessary files for getting the given data.
+        """
+        return (o.file_path() for o in itertools.chain.from_iterable(self.iter_combinations(**data)))
 
     def get_results_dataframe(self, **data):
         """
         Gets the results specified by result_names from all the parameter combinations.
-        Returns a Pandas Dataframe.
+        Returns a Pandas Dataframe, with typed columns (see typed_column and result_column).
+        With the arrow option, a pyarrow Table is returned instead, which can be handed to e.g. Polars or DuckDB without copying.
+        How results are read is given by the options (see ParameterCombinations).
+
+        If a result store has been set (see snakehelp.config.set_result_store), results are read from the store instead.
         """
+        if get_result_store() is not None:
+            df = self._get_results_dataframe_from_store(get_result_store(), self.options["errors"], data)
+        elif self.options["index"] is None and self.supports_grid():
+            df = self._get_results_dataframe_from_grid(data)
+        else:
+            df = self._get_results_dataframe_from_objects(data)
+        return _to_arrow(df) if self.options["arrow"] else df
+
+    def _dataframe(self, parameter_columns, result_columns):
+        """Returns a Dataframe with typed columns from a list of columns for each parameter and for each result type"""
+        import pandas as pd
+        columns = {field.name: typed_column(column, field.type) for field, column in zip(self.result_types[0].get_fields(), parameter_columns)}
+        columns.update((result_type.__name__, result_column(column)) for result_type, column in zip(self.result_types, result_columns))
+        return pd.DataFrame(columns)
+
+    def _get_results_dataframe_from_objects(self, data):
+        workers, executor, errors, index, cache = (self.options[name] for name in ("workers", "executor", "errors", "index", "cache"))
+        combinations = self.combinations(**data)
+        n_results = len(self.result_types)
+        if index is None:
+            files = [result.file_path() for combination in combinations for result in combination]
+            values, failed = fetch_results(files, workers, executor, cache)
+            result_columns = [values[i::n_results] for i in range(n_results)]
+        else:
+            # an index given by its path is only opened for this call
+            with (ResultIndex(index) if isinstance(index, str) else contextlib.nullcontext(index)) as index:
+                result_columns = []
+                failed = {}
+                for i in range(n_results):
+                    values, result_failed = index.fetch([combination[i] for combination in combinations], workers, executor)
+                    result_columns.append(values)
+                    failed.update(result_failed)
+
+        _report_errors(failed, errors)
+
+        # all results should be from the same parameters
+        flat_data = [combination[0].flat_data() for combination in combinations]
+        parameter_columns = [[row[i] for row in flat_data] for i in range(len(self.result_types[0].parameters))]
+        return self._dataframe(parameter_columns, result_columns)
+
+    def _get_results_dataframe_from_grid(self, data):
+        grid = self.grid(**data)
+        file_columns = [result_type.__name__ + "_file" for result_type in self.result_types]
+        files = grid[file_columns].to_numpy().ravel().tolist()
+        values, failed = fetch_results(files, self.options["workers"], self.options["executor"], self.options["cache"])
+        _report_errors(failed, self.options["errors"])
+
+        n_results = len(self.result_types)
+        return self._dataframe([grid[name] for name in self.result_types[0].parameters],
+                               [values[i::n_results] for i in range(n_results)])
+
+    def _get_results_dataframe_from_store(self, store, errors, data):
+        import pandas as pd
         combinations = self.combinations(**data)
+        names = self.result_types[0].parameters
+        df = pd.DataFrame([combination[0].flat_data() for combination in combinations], columns=names)
+        failed = {}
+        for i, result_type in enumerate(self.result_types):
+            # filters on the given data are pushed down to the store, defaults are matched by the merge
+            values = store.read(result_type, **data).rename(columns={"value": result_type.__name__})
+            if len(values) == 0:
+                df[result_type.__name__] = None
+            else:
+                df = df.merge(values, on=names, how="left")
+
+            for row in df.index[df[result_type.__name__].isna()]:
+                failed[combinations[row][i].file_path()] = KeyError(f"No result stored in {store.folder}")
+
+        _report_errors(failed, errors)
+
+        return self._dataframe([df[name] for name in names], [df[result_type.__name__] for result_type in self.result_types])
+
+    def watch(self, **data):
+        """
+        Follows the results while they are being made. Yields a Pandas Dataframe like get_results_dataframe
+        gives, first with the results that exist now and then every time result files have been created or changed
+        (at most once every interval seconds). Only new or changed files are read. Missing results (and results
+        that cannot be read yet) are NaN.
+
+        Stops when every result exists, or when timeout seconds have passed.
+        Changes are found with inotify if inotify_simple is installed (or the use_inotify option is True),
+        otherwise by polling (see snakehelp.watch).
+        If a result store has been set, the store is read again every interval seconds instead.
+        interval, timeout, use_inotify and workers are options (see ParameterCombinations).
+        """
+        import time
+        from .watch import file_watcher
+        interval, timeout, workers = self.options["interval"], self.options["timeout"], self.options["workers"]
+
+        if get_result_store() is not None:
+            yield from self._watch_store(get_result_store(), interval, timeout, data)
+            return
+
+        if self.supports_grid():
+            grid = self.grid(**data)
+            parameter_columns = [grid[name] for name in self.result_types[0].parameters]
+            file_columns = [grid[result_type.__name__ + "_file"].tolist() for result_type in self.result_types]
+        else:
+            combinations = self.combinations(**data)
+            flat_data = [combination[0].flat_data() for combination in combinations]
+            parameter_columns = [[row[i] for row in flat_data] for i in range(len(self.result_types[0].parameters))]
+            file_columns = [[combination[i].file_path() for combination in combinations] for i in range(len(self.result_types))]
+
+        files = list(dict.fromkeys(file for column in file_columns for file in column))
+        watcher = file_watcher(files, self.options["use_inotify"])
+        values = {}
+        start = time.monotonic()
+        candidates = None
+        first = True
+        try:
+            while True:
+                changed = watcher.changed(candidates)
+                if len(changed) > 0 or first:
+                    first = False
+                    changed_values, failed = fetch_results(changed, workers)
+                    for file, value in zip(changed, changed_values):
+                        if file in failed:
+                            # probably still being written, it will be read again when it changes
+                            values.pop(file, None)
+                        else:
+                            values[file] = value
+                    yield self._dataframe(parameter_columns, [[values.get(file) for file in column] for column in file_columns])
+
+                if len(values) == len(files) or (timeout is not None and time.monotonic() - start >= timeout):
+                    return
+                waited = time.monotonic()
+                candidates = watcher.wait(interval)
+                # throttle, so that a burst of changes gives one update. Events during the sleep are kept for the next wait
+                time.sleep(max(0.0, interval - (time.monotonic() - waited)))
+        finally:
+            watcher.close()
+
+    def _watch_store(self, store, interval, timeout, data):
+        """Polls the result store, and yields the dataframe from it every time it has changed"""
+        import time
+        result_names = [result_type.__name__ for result_type in self.result_types]
+        start = time.monotonic()
+        last = None
+        while True:
+            df = self._get_results_dataframe_from_store(store, "ignore", data)
+            if last is None or not df.equals(last):
+                last = df
+                yield df
+
+            if df[result_names].notna().all().all() or (timeout is not None and time.monotonic() - start >= timeout):
+                return
+            time.sleep(interval)
+
+    def scan_results_dataframe(self, **data):
+        """
+        Finds all results that exist on disk by scanning the data folder once, instead of
+        opening one file for every combination of parameters.
+
+        Data can be given to only keep results where parameters have the given value(s).
+        Results types that are missing for a set of parameters are NaN. Returns a Pandas Dataframe.
+        The workers, executor, errors and arrow options are used as in get_results_dataframe.
+        """
+        import pandas as pd
+        workers, executor, errors = self.options["workers"], self.options["executor"], self.options["errors"]
+        data = {key: at_least_list(value) for key, value in data.items()}
+        names = self.result_types[0].parameters
+        # the data folder is walked once for all result types
+        found_by_type = [[] for _ in self.result_types]
+        for i, path, obj in scan_many([result_type.parser() for result_type in self.result_types]):
+            found_by_type[i].append((path, obj))
+
+        df = None
+        for result_type, found in zip(self.result_types, found_by_type):
+            values, failed = fetch_results([path for path, _ in found], workers, executor)
+            _report_errors(failed, errors)
+            rows = [obj.flat_data() + [value] for (_, obj), value in zip(found, values)]
+            result_df = pd.DataFrame(rows, columns=names + [result_type.__name__])
+            for name, values in data.items():
+                result_df = result_df[result_df[name].isin(values)]
+            result_df = self._filter_shard(result_df)
+
+            if df is None:
+                df = result_df
+            else:
+                df = df.merge(result_df, on=names, how="outer")
+
+        df = self._dataframe([df[name] for name in names], [df[result_type.__name__] for result_type in self.result_types])
+        return _to_arrow(df) if self.options["arrow"] else df
+
+
+class CollectionPlanner:
+    """
+    Collects the results for many ParameterCombinations (e.g. one for each plot) together.
+
+    Add the combinations and data of each dataframe that is needed with add(). collect() then takes the union
+    of all the grids, reads every distinct result file once into one shared frame for each result type,
+    and gives each request the rows of the shared frames that it asked for, in the same layout as
+    ParameterCombinations.get_results_dataframe.
+    """
+    def __init__(self):
+        self._requests = []
+
+    def add(self, combinations, **data):
+        """Adds a request and returns its number, which is its position in the list returned by collect()"""
+        self._requests.append((combinations, data))
+        return len(self._requests) - 1
+
+    def shared_frames(self, grids, workers=1, executor="thread", errors="raise"):
+        """
+        Returns a dict from result type to a Pandas Series with the value of every distinct result file
+        in the grids, indexed by file name. All errors are reported together.
+        """
+        import pandas as pd
+        files = {}
+        for (combinations, _), grid in zip(self._requests, grids):
+            if grid is None:
+                continue
+            for result_type in combinations.result_types:
+                files.setdefault(result_type, []).append(grid[result_type.__name__ + "_file"])
+
+        unique_files = {result_type: pd.unique(pd.concat(columns, ignore_index=True)).tolist() for result_type, columns in files.items()}
+        # all files are read in one go, so that workers are kept busy across result types
+        values, failed = fetch_results([file for type_files in unique_files.values() for file in type_files], workers, executor)
+        _report_errors(failed, errors)
+
+        frames = {}
+        start = 0
+        for result_type, type_files in unique_files.items():
+            frames[result_type] = pd.Series(values[start:start + len(type_files)], index=type_files, name=result_type.__name__, dtype=object)
+            start += len(type_files)
+        return frames
 
-        data = []
+    def collect(self, workers=1, executor="thread", errors="raise"):
+        """Returns one Pandas Dataframe for every request, in the order they were added"""
+        # requests that cannot be gridded (or are answered by a result store) are fetched on their own,
+        # sharing a cache so that files are still only read once
+        use_grid = get_result_store() is None
+        grids = [combinations.grid(**data) if use_grid and combinations.supports_grid() else None
+                 for combinations, data in self._requests]
+        frames = self.shared_frames(grids, workers, executor, errors)
 
-        for combination in combinations:
-            row = []
-            first_result = combination[0]  # all results should be from the same parameters
-            row.extend(first_result.flat_data())
-            for result in combination:
-                row.append(result.fetch_result())
-            data.append(row)
+        cache = {}
+        dataframes = []
+        for (combinations, data), grid in zip(self._requests, grids):
+            if grid is None:
+                dataframes.append(combinations.with_options(workers=workers, executor=executor, errors=errors, cache=cache).get_results_dataframe(**data))
+                continue
 
-        names = combinations[0][0].__class__.parameters + [result.__class__.__name__ for result in combinations[0]]
-        return pd.DataFrame(data, columns=names)
+            dataframes.append(combinations._dataframe(
+                [grid[name] for name in combinations.result_types[0].parameters],
+                [frames[result_type].reindex(grid[result_type.__name__ + "_file"]) for result_type in combinations.result_types]
+            ))
+        return dataframes
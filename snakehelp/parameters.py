@@ -1,13 +1,19 @@
+import functools
 import itertools
 import os
+import sys
 from collections import namedtuple
 from pathlib import Path
 from dataclasses import dataclass, fields
 #from types import UnionType
 from typing import get_origin, Literal, Union, get_args, Optional, List
-from snakehelp.snakehelp import classproperty, string_is_valid_type, type_to_regex
-from .config import get_data_folder
-from shared_memory_wrapper import to_file, from_file
+from snakehelp.snakehelp import classproperty, type_to_regex, compile_validator, validate_many, sequences_to_regex
+from .config import get_data_folder, get_result_store
+from .path_template import compile_template
+from .path_parser import compile_parser
+from .registry import register, unregister, wildcard_constraints
+from .sharding import parse_shard, shard_of
+from types import MappingProxyType
 import dataclasses
 
 class ParameterLike:
@@ -20,6 +26,50 @@ class ResultLike:
 
 field_tuple = namedtuple("Field", ["name", "type", "default"])
 
+# max number of paths cached by each input function returned by as_input
+AS_INPUT_CACHE_SIZE = 2 ** 16
+
+
+class Wildcard(str):
+    """
+    A Snakemake wildcard {name,regex} in a path. Behaves as the string, but also
+    knows the name and the regex.
+    """
+    def __new__(cls, name, regex):
+        wildcard = super().__new__(cls, "{" + name + "," + regex + "}")
+        wildcard.name = name
+        wildcard.regex = regex
+        return wildcard
+
+
+class Schema(namedtuple("Schema", ["generation", "fields", "field_lists", "parameters", "minimal_parameters",
+                                   "index", "dataclass_fields", "segments", "validators", "wildcards"])):
+    """
+    Immutable, precomputed description of the fields of a @parameters class.
+
+    fields: the direct fields of the class (with limited union choices applied)
+    field_lists: maps (minimal, minimal_children) to the flat field list returned by get_fields
+    parameters/minimal_parameters: names of the flat fields
+    index: maps a flat parameter name to its position in parameters
+    dataclass_fields: maps a name to the raw dataclasses.Field
+    segments: for every flat field, the path segments (regex fragments) used by as_output when the field is not forced
+    validators: maps a flat parameter name to a compiled validator for its type
+    wildcards: maps the name of every wildcard in the path (from as_output without arguments) to its regex
+    """
+
+    def get_fields(self, minimal=False, minimal_children=False):
+        return self.field_lists[(minimal, minimal_children)]
+
+
+# Schemas are built lazily and cached on each class. Changing union choices on any class
+# bumps the generation, which makes all cached schemas (also those of parent classes) stale.
+_schema_generation = 0
+
+
+def _invalidate_schemas():
+    global _schema_generation
+    _schema_generation += 1
+
 
 def result(base_class):
     class Result(parameters(base_class), ResultLike):
@@ -31,11 +81,18 @@ def result(base_class):
 
     Result.__name__ = base_class.__name__
     Result.__qualname__ = base_class.__qualname__
+    # replaces the registration of the Parameters-class made above
+    register(Result, base_class.__module__)
 
     return Result
 
 
 def union_type_to_regex(field):
+    """
+    Returns the path segments for a Union field of @parameters types. Fields that all
+    members share at the beginning and end get their own wildcards, while the fields that differ
+    are matched by one wildcard with an exact regex for the members' path segments.
+    """
     name = field.name
     type = field.type
     args = get_args(type)
@@ -43,45 +100,111 @@ def union_type_to_regex(field):
     for field in args:
         assert hasattr(field, "get_fields"), "UNion only supported for ParameterLike objects now" + str(field)
 
-    out = []
     # check if the different types in args share fields
-    all_fields = list(zip(*[arg.get_fields(minimal_children=True) for arg in args]))
-    i = 0
-    for i, fields in enumerate(all_fields):
-        if all(field.name == fields[0].name for field in fields):
-            # all fields have the same name, we can merge them
-            out.append(["{" + fields[0].name + "," + type_to_regex(fields[0].type) + "}"])
-        else:
-            # no more shared fields at beginning, don't try to look for more
-            break
-
-    # todo: Also look for shared fields at the end
-    # make new all_fields which is zipped from the end
-    add_at_end = []
-    if i < len(all_fields)-1:
-        all_fields_from_end = list(zip(*[arg.get_fields(minimal_children=True)[::-1] for arg in args]))
-        # some fields left at end
-        for j, fields in enumerate(all_fields_from_end):
-            if len(add_at_end) + len(out) == len(all_fields):
-                # we have added all fields
-                break
-
-            if all(field.name == fields[0].name for field in fields):
-                # all fields have the same name, we can merge them
-                add_at_end.insert(0, ["{" + fields[0].name + "," + type_to_regex(fields[0].type) + "}"])
-            else:
-                break
+    all_fields = [arg.get_fields() for arg in args]
+    all_regexes = [[type_to_regex(field.type) for field in fields] for fields in all_fields]
+
+    def is_shared(i):
+        return all(fields[i].name == all_fields[0][i].name for fields in all_fields) and \
+            all(regexes[i] == all_regexes[0][i] for regexes in all_regexes)
+
+    shortest = min(len(fields) for fields in all_fields)
+    n_start = 0
+    while n_start < shortest and is_shared(n_start):
+        n_start += 1
 
-    # if fewer fields than all are added, there are some that don't match at the middle
-    if len(out) + len(add_at_end) < len(all_fields):
-        out.append(["{" + name + "_unknown_union_params,.*}"])
+    n_end = 0
+    while n_start + n_end < shortest and is_shared(-1 - n_end):
+        n_end += 1
 
-    out.extend(add_at_end)
+    middles = [regexes[n_start:len(regexes) - n_end] for regexes in all_regexes]
+    if any(len(middle) == 0 for middle in middles) and not all(len(middle) == 0 for middle in middles):
+        # path segments cannot be optional in a wildcard, so the whole union is matched by one wildcard
+        n_start, n_end = 0, 0
+        middles = all_regexes
 
-    # add one wildcard for the rest if there are more
+    shared_fields = all_fields[0]
+    out = []
+    for shared_field in shared_fields[:n_start]:
+        out.extend(_field_segments(shared_field))
+    if any(len(middle) > 0 for middle in middles):
+        out.append([Wildcard(name + "_unknown_union_params", sequences_to_regex(middles))])
+    for shared_field in shared_fields[len(shared_fields) - n_end:]:
+        out.extend(_field_segments(shared_field))
     return out
 
 
+def _field_segments(field):
+    """Returns the path segments used by as_output for a (flat) field that is not forced to a value"""
+    if get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
+        # literal types enforces a single value, should not be wildcards
+        return [[get_args(field.type)[0]]]
+    elif get_origin(field.type) == Union and all(hasattr(t, "get_fields") for t in get_args(field.type)):
+        # UnionType with Parameterlike objects. We want to keep common subfields
+        # if all types start with same fields, we want to keep them
+        return union_type_to_regex(field)
+    else:
+        return [[Wildcard(field.name, type_to_regex(field.type))]]
+
+
+def _build_field_list(direct_fields, minimal, minimal_children):
+    out = []
+    for field in direct_fields:
+        if minimal and get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
+            continue
+
+        if field.type in (int, str, float):
+            out.append(field_tuple(field.name, field.type, field.default))
+        elif get_origin(field.type) in (Literal, Union):
+            default = field.default
+            if get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
+                default = get_args(field.type)[0]
+            out.append(field_tuple(field.name, field.type, default))
+        else:
+            assert hasattr(field.type, "get_fields"), "Field type %s is not valid. " \
+                                                      "Must be a base type or a class decorated with @parameters" % field.type
+            out.extend(field.type.get_fields(minimal=minimal_children, minimal_children=minimal_children))
+
+    return tuple(out)
+
+
+def _build_schema(cls):
+    direct_fields = []
+    for field in dataclasses.fields(cls):
+        if get_origin(field.type) == Union:
+            # check if this union type has been limited
+            # this union type has been limited, replace it with the limited type
+            limited_types = [t for t in get_args(field.type) if get_class_name(t) in cls._union_choices]
+            if len(limited_types) == 1:
+                direct_fields.append(field_tuple(name=field.name, type=limited_types[0], default=field.default))
+                continue
+        direct_fields.append(field)
+
+    field_lists = {
+        (minimal, minimal_children): _build_field_list(direct_fields, minimal, minimal_children)
+        for minimal in (False, True) for minimal_children in (False, True)
+    }
+    flat_fields = field_lists[(False, False)]
+    parameters = tuple(field.name for field in flat_fields)
+    segments = tuple(tuple(tuple(options) for options in _field_segments(field)) for field in flat_fields)
+
+    return Schema(
+        generation=_schema_generation,
+        fields=tuple(direct_fields),
+        field_lists=MappingProxyType(field_lists),
+        parameters=parameters,
+        minimal_parameters=tuple(field.name for field in field_lists[(True, False)]),
+        index=MappingProxyType({name: i for i, name in enumerate(parameters)}),
+        dataclass_fields=MappingProxyType({field.name: field for field in dataclasses.fields(cls)}),
+        segments=segments,
+        validators=MappingProxyType({field.name: compile_validator(field.type) for field in flat_fields}),
+        wildcards=MappingProxyType({
+            wildcard.name: wildcard.regex
+            for field_segments in segments for options in field_segments for wildcard in options if isinstance(wildcard, Wildcard)
+        })
+    )
+
+
 def parameters(base_class):
     """
     Decorator to make a class into a class that can be used as parameters.
@@ -91,40 +214,44 @@ def parameters(base_class):
         file_ending = base_class.file_ending if hasattr(base_class, "file_ending") else ""
         _union_choices = []
 
+        _schema = None
+
+        @classmethod
+        def schema(cls):
+            """
+            Returns the precomputed Schema of this class. The schema is built on first access and
+            rebuilt only after union choices have been changed.
+            """
+            # look in the class dict so that subclasses (e.g. Results) don't pick up the schema of their base
+            schema = cls.__dict__.get("_schema")
+            if schema is None or schema.generation != _schema_generation:
+                schema = _build_schema(cls)
+                cls._schema = schema
+            return schema
+
         @classproperty
         def _field_names(cls):
-            return [field.name for field in fields(cls)]
+            return list(cls.schema().dataclass_fields)
 
         @classmethod
         def field(cls, name):
             """
             Returns the field with given name if it exists
             """
-            matches = [f for f in fields(cls) if f.name == name]
-            assert len(matches) == 1, f"Tried to access field {name} on {cls}. Does not exist."
-            return matches[0]
+            dataclass_fields = cls.schema().dataclass_fields
+            assert name in dataclass_fields, f"Tried to access field {name} on {cls}. Does not exist."
+            return dataclass_fields[name]
 
         def get_field(cls, name):
             """Returns a field by name"""
-            matches = [f for f in cls.fields() if f.name == name]
+            matches = [f for f in cls.schema().fields if f.name == name]
             assert len(matches) == 1
             return matches[0]
 
         @classmethod
         def fields(cls):
             """Simple wrapper around dataclasses fields. Only difference is that Union types can be limited"""
-            f = dataclasses.fields(cls)
-            out = []
-            for field in f:
-                if get_origin(field.type) == Union:
-                    # check if this union type has been limited
-                    # this union type has been limited, replace it with the limited type
-                    limited_types = [t for t in get_args(field.type) if get_class_name(t) in cls._union_choices]
-                    if len(limited_types) == 1:
-                        out.append(field_tuple(name=field.name, type=limited_types[0], default=field.default))
-                        continue
-                out.append(field)
-            return out
+            return list(cls.schema().fields)
 
         @classmethod
         def get_fields(cls, minimal=False, minimal_children=False):
@@ -136,24 +263,7 @@ def parameters(base_class):
 
             minimal_children specifies only whether children should be minimal.
             """
-            out = []
-            for field in cls.fields():
-                if minimal and get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
-                    continue
-
-                if field.type in (int, str, float):
-                    out.append(field_tuple(field.name, field.type, field.default))
-                elif get_origin(field.type) in (Literal, Union):
-                    default = field.default
-                    if get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
-                        default = get_args(field.type)[0]
-                    out.append(field_tuple(field.name, field.type, default))
-                else:
-                    assert hasattr(field.type, "get_fields"), "Field type %s is not valid. " \
-                                                              "Must be a base type or a class decorated with @parameters" % field.type
-                    out.extend(field.type.get_fields(minimal=minimal_children, minimal_children=minimal_children))
-
-            return out
+            return list(cls.schema().get_fields(minimal, minimal_children))
 
         @classmethod
         def limit_union_choice(cls, type: str):
@@ -163,17 +273,19 @@ def parameters(base_class):
             """
             assert isinstance(type, str)
             cls._union_choices.append(type)
+            _invalidate_schemas()
 
         @classmethod
         def clear_union_choices(cls):
             cls._union_choices = []
+            _invalidate_schemas()
 
         @classproperty
         def parameters(cls):
             """
             Returns a list of names of parameters.
             """
-            return [field.name for field in cls.get_fields()]
+            return list(cls.schema().parameters)
 
         @classproperty
         def minimal_parameters(cls):
@@ -181,37 +293,80 @@ def parameters(base_class):
             Returns a list of the minimum set of parameters needed to uniquely represent
             this objeckt, meaning that Literal parameters with only one possible value are ignored.
             """
-            return [field.name for field in cls.get_fields(minimal=True)]
+            return list(cls.schema().minimal_parameters)
 
         @classmethod
-        def as_input(cls):
+        def as_input(cls, cache_size=AS_INPUT_CACHE_SIZE):
             """
             Returns an input-function that can be used by Snakemake.
+
+            Paths are cached (LRU, at most cache_size entries) on the values of the wildcards
+            that are parameters of this class, since Snakemake calls the input function for every job.
+            Cache statistics (hits, misses) are available through func.cache_info().
+            The cache is keyed on the schema generation, so paths follow later changes of union choices.
             """
+            @functools.lru_cache(maxsize=1)
+            def parameter_names(generation):
+                return frozenset(cls.schema().parameters)
+
+            @functools.lru_cache(maxsize=cache_size)
+            def cached_path(generation, data_folder, wildcard_values):
+                return cls.as_output(**dict(wildcard_values))
 
             def func(wildcards):
                 assert hasattr(wildcards,
                                "items"), "As input can only be called with a dictlike object with an items() method"
 
-                fields = cls.get_fields()
                 # create a path from the wildcards and the parameters
-                # can maybe be done by just calling output with these wildcards.
-                return cls.as_output(**{name: t for name, t in wildcards.items() if name in cls.parameters})
+                generation = _schema_generation
+                names = parameter_names(generation)
+                wildcard_values = tuple((name, value) for name, value in wildcards.items() if name in names)
+                return cached_path(generation, get_data_folder(), wildcard_values)
 
-                path = []
+            func.cache_info = cached_path.cache_info
+            func.cache_clear = cached_path.cache_clear
+            return func
 
-                """
-                for i, (name, value) in enumerate(wildcards.items()):
-                    if i >= len(fields):
-                        break
-                    assert name == fields[i].name, f"Parsing {cls}. Invalid at {i}, name: {name}, expected {fields[i].name}"
-                    assert string_is_valid_type(value, fields[i].type), f"{value} is not a valid as type {fields[i].type}"
-                    path.append(value)
+        @classmethod
+        def template(cls):
+            """
+            Returns a compiled PathTemplate for this class, which can render many paths
+            in one pass with render_many(**columns).
+            """
+            return compile_template(cls, _schema_generation, get_data_folder())
 
-                return os.path.sep.join(path)
-                """
+        @classmethod
+        def parser(cls):
+            """
+            Returns a compiled PathParser for this class, used by from_path and from_paths.
+            """
+            return compile_parser(cls, _schema_generation, get_data_folder())
 
-            return func
+        @classmethod
+        def from_path(cls, path):
+            """
+            Creates an object from a file path (the inverse of file_path()).
+            Values are converted to the types of the fields.
+            """
+            obj = cls.parser().parse(path)
+            assert obj is not None, f"Path {path} is not a valid path for {cls} (should match {cls.parser().regex.pattern})"
+            return obj
+
+        @classmethod
+        def from_paths(cls, paths, skip_invalid=False):
+            """
+            Creates one object for every path. Paths that don't match
+            are left out if skip_invalid is True.
+            """
+            return cls.parser().parse_many(paths, skip_invalid=skip_invalid)
+
+        @classmethod
+        def scan(cls):
+            """
+            Yields an object for every file in the data folder that is a valid path for this class.
+            The data folder is walked once, and only directories that can lead to a valid path are entered.
+            """
+            return (obj for path, obj in cls.parser().scan())
 
         @classmethod
         def path(cls, **kwargs):
@@ -240,23 +395,35 @@ def parameters(base_class):
             return get_data_folder() + os.path.sep.join(map(str, self.flat_data())) + file_name + self.file_ending
 
         def store_result(self, result):
+            """
+            Stores the result in the file given by file_path(). Numpy arrays are stored
+            in .npy-format, everything else is stored as text.
+            """
+            if get_result_store() is not None:
+                get_result_store().append(self, result)
+                return
+
             file = self.file_path()
             path = os.path.sep.join(file.split(os.path.sep)[:-1])
             Path(path).mkdir(parents=True, exist_ok=True)
+            if _is_numpy_array(result):
+                import numpy as np
+                # write through a file object so that numpy does not add .npy to the file name
+                with open(file, "wb") as f:
+                    np.save(f, result, allow_pickle=False)
+                return
+
             with open(file, "w") as f:
                 f.write(str(result))
-            #to_file(result, path)
-
-        def fetch_result(self):
-            with open(self.file_path()) as f:
-                data = f.read().strip()
-                try:
-                    data = float(data)
-                except ValueError:
-                    data = data
 
-                return data
-            #return from_file(self.file_path())
+        def fetch_result(self, mmap=False):
+            """
+            Returns the stored result. If mmap is True, arrays are returned as
+            read-only memory maps instead of being read into memory.
+            """
+            if get_result_store() is not None:
+                return get_result_store().fetch(self)
+            return read_result(self.file_path(), mmap=mmap)
 
         @classmethod
         def from_flat_params(cls, **params):
@@ -286,39 +453,91 @@ def parameters(base_class):
             Returns a valid Snakemake wildcard string with regex so force types
 
             Keyword arguments can be specified to fix certain variables to values.
+            _shard=(index, count) only gives the paths in one shard (see iter_output).
+            """
+            out_files = list(cls.iter_output(**kwargs))
+            if len(out_files) == 1:
+                return out_files[0]
+            else:
+                return out_files
+
+        @classmethod
+        def iter_output(cls, _shard=None, **kwargs):
+            """
+            Same as as_output, but returns an iterator that lazily yields the paths (also when there is only one).
+            The combinations of list-valued keyword arguments are never materialized in memory.
+
+            _shard is reserved for giving a shard as (index, count) or "index/count". Then only the paths
+            in that shard are given (see snakehelp.sharding.shard_of), which is the same shard as
+            ParameterCombinations.shard gives for the same parameters. All parameters must then be given,
+            since the shard of a path with wildcards is not the shard of the paths it matches.
+            """
+            if _shard is None:
+                return _join_segments(cls._output_segments(**kwargs))
+
+            index, count = parse_shard(_shard)
+            labelled_segments = cls._labelled_output_segments(**kwargs)
+            parameter_positions = [i for i, (label, _) in enumerate(labelled_segments) if label is not None]
+            missing = [labelled_segments[i][0] for i in parameter_positions if labelled_segments[i][0] not in kwargs]
+            assert len(missing) == 0, f"All parameters must be given to get the paths in a shard. Missing: {missing}"
+            names = [labelled_segments[i][0] for i in parameter_positions]
+            return (
+                os.path.sep.join(out_file[:-1]) + out_file[-1]
+                for out_file in itertools.product(*(options for _, options in labelled_segments))
+                if shard_of(names, [out_file[i] for i in parameter_positions], count) == index
+            )
+
+        @classmethod
+        def output_pattern(cls, **kwargs):
             """
+            Same as as_output, but wildcards that are constrained globally (by the
+            wildcard_constraints of all registered classes) are written without a regex, e.g. {seed}.
+            Use together with snakehelp.wildcard_constraints_block() or wildcard_constraints() in the Snakefile.
+            """
+            return pattern(cls, wildcard_constraints(), **kwargs)
+
+        @classmethod
+        def _output_segments(cls, **kwargs):
+            """
+            Returns a list with the possible values of every part of the output path. The last element
+            is the file ending.
+            """
+            return [options for _, options in cls._labelled_output_segments(**kwargs)]
+
+        @classmethod
+        def _labelled_output_segments(cls, **kwargs):
+            """
+            Returns a list of (label, options) for every part of the output path. The label is the name of
+            the parameter for parts given by a parameter, and None for the data folder, file name and file ending.
+            """
+            schema = cls.schema()
             names_with_regexes = []
             if get_data_folder() != "":
-                names_with_regexes.append([get_data_folder().replace(os.path.sep, "")])
+                names_with_regexes.append((None, [get_data_folder().replace(os.path.sep, "")]))
 
             for name in kwargs:
                 if name != "file_ending" and name != "file_name":
-                    assert name in cls.parameters, "Trying to force a field '%s' which is not among the available fields which are %s" % (name, cls.parameters)
+                    assert name in schema.index, "Trying to force a field '%s' which is not among the available fields which are %s" % (name, cls.parameters)
 
 
-            for field in cls.get_fields(minimal_children=False):
+            for field, segments in zip(schema.get_fields(), schema.segments):
                 if field.name in kwargs:
                     # value has been specified. If this is a list, we want to return multiple possible values
                     forced_values = kwargs[field.name]
                     if not isinstance(forced_values, list):
                         forced_values = [forced_values]
 
-                    for forced_value in forced_values:
-                        assert string_is_valid_type(forced_value, field.type), \
+                    for forced_value, is_valid in zip(forced_values, validate_many(forced_values, field.type, schema.validators[field.name])):
+                        assert is_valid, \
                             f"Trying to set field {field.name} to value {forced_value}, " \
                             f"but this is not compatible with the field type {field.type}."
 
-                    names_with_regexes.append([str(v) for v in forced_values])
+                    names_with_regexes.append((field.name, [str(v) for v in forced_values]))
+                elif len(segments) == 1:
+                    names_with_regexes.append((field.name, segments[0]))
                 else:
-                    if get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
-                        # literal types enforces a single value, should not be wildcards
-                        names_with_regexes.append([get_args(field.type)[0]])
-                    elif get_origin(field.type) == Union and all(hasattr(t, "get_fields") for t in get_args(field.type)):
-                        # UnionType with Parameterlike objects. We want to keep common subfields
-                        # if all types start with same fields, we want to keep them
-                        names_with_regexes.extend(union_type_to_regex(field))
-                    else:
-                        names_with_regexes.append(["{" + field.name + "," + type_to_regex(field.type) + "}"])
+                    # a Union of @parameters types can span several parts
+                    names_with_regexes.extend((f"{field.name}.{i}", options) for i, options in enumerate(segments))
 
             # file name
             file_name = cls.file_name
@@ -329,7 +548,7 @@ def parameters(base_class):
                 if not isinstance(file_name, list):
                     file_name = [file_name]
 
-                names_with_regexes.append(file_name)
+                names_with_regexes.append((None, file_name))
 
             # file ending can be overwritten
             file_ending = cls.file_ending
@@ -339,22 +558,8 @@ def parameters(base_class):
             if not isinstance(file_ending, list):
                 file_ending = [file_ending]
 
-            names_with_regexes.append(file_ending)
-            out_files = itertools.product(*names_with_regexes)
-
-            try:
-                # join everything expect file ending (last element) with path sep
-                out_files = [os.path.sep.join(out_file[:-1]) + out_file[-1] for out_file in out_files]
-            except TypeError:
-                print(out_files)
-                raise
-
-            if len(out_files) == 1:
-                return out_files[0]
-            else:
-                return out_files
-
-            #return os.path.sep.join(names_with_regexes)
+            names_with_regexes.append((None, file_ending))
+            return names_with_regexes
 
         @classmethod
         def replace_field(cls, field_name: str, new_field):
@@ -372,14 +577,74 @@ def parameters(base_class):
             decorator = parameters
             if issubclass(cls, ResultLike):
                 decorator = result
-            return decorator(dataclasses.make_dataclass(cls.__name__, new_fields))
+            new_class = decorator(dataclasses.make_dataclass(cls.__name__, new_fields))
+            # the new class has the same name as cls, so it should not be found by name or give wildcard constraints
+            unregister(new_class)
+            return new_class
 
     Parameters.__name__ = base_class.__name__
     Parameters.__qualname__ = base_class.__qualname__
+    register(Parameters, base_class.__module__)
 
     return Parameters
 
 
+def _join_segments(names_with_regexes):
+    # join everything expect file ending (last element) with path sep
+    return (os.path.sep.join(out_file[:-1]) + out_file[-1] for out_file in itertools.product(*names_with_regexes))
+
+
+def pattern(parameter_type, constraints=None, **kwargs):
+    """
+    Returns the output path(s) of the parameter type (see as_output) where wildcards are
+    written without regex ({name}) when constraints (a dict from wildcard name to regex) has the same regex.
+    If constraints is None, no wildcards get a regex, which is what Snakemake input patterns need.
+    """
+    names_with_regexes = [
+        [
+            "{" + value.name + "}" if isinstance(value, Wildcard) and (constraints is None or constraints.get(value.name) == value.regex) else value
+            for value in values
+        ]
+        for values in parameter_type._output_segments(**kwargs)
+    ]
+    out_files = list(_join_segments(names_with_regexes))
+    if len(out_files) == 1:
+        return out_files[0]
+    return out_files
+
+
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def _is_numpy_array(obj):
+    # numpy is only imported when needed. If it has not been imported, obj cannot be an array
+    numpy = sys.modules.get("numpy")
+    return numpy is not None and isinstance(obj, numpy.ndarray)
+
+
+def read_result(file_name, mmap=False):
+    """
+    Reads a result stored with store_result. Arrays stored in .npy-format are returned as numpy
+    arrays (read-only memory maps if mmap is True). Other results are returned as
+    a float if possible, otherwise a string.
+    """
+    with open(file_name, "rb") as f:
+        is_array = f.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+    if is_array:
+        import numpy as np
+        return np.load(file_name, mmap_mode="r" if mmap else None, allow_pickle=False)
+
+    with open(file_name) as f:
+        data = f.read().strip()
+        try:
+            data = float(data)
+        except ValueError:
+            data = data
+
+        return data
+
+
 def get_class_name(cls):
     full_name = cls.__name__
     return full_name.split(".")[-1]
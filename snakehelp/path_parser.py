@@ -0,0 +1,175 @@
+import functools
+import itertools
+import os
+import re
+from typing import get_origin, get_args, Literal, Union
+from snakehelp.snakehelp import type_to_regex, is_parameter_type
+
+
+class PathParser:
+    """
+    Parses file paths back into objects of a @parameters class.
+
+    All possible layouts of the class (one for every choice of Union members) are compiled into one
+    anchored regex built from the same type_to_regex fragments that as_output uses. Union members
+    are tried in the order they are declared, so the first member that fits the path wins.
+    """
+    def __init__(self, parameter_type, data_folder=""):
+        self.parameter_type = parameter_type
+        self._alternatives = []
+        regex_alternatives = []
+        segment_regexes = []
+        for k, (leaves, build) in enumerate(_alternatives(parameter_type)):
+            sentinel = "a%d" % k
+            group_names = ["a%d_%d" % (k, i) for i in range(len(leaves))]
+            regex_alternatives.append(
+                "(?P<%s>)" % sentinel +
+                re.escape(os.path.sep).join("(?P<%s>%s)" % (name, regex) for name, (regex, _) in zip(group_names, leaves))
+            )
+            self._alternatives.append((sentinel, group_names, [coerce for _, coerce in leaves], build))
+            segment_regexes.append([re.compile(regex) for regex, _ in leaves])
+
+        self.prefix = data_folder
+        self.suffix = ""
+        if parameter_type.file_name is not None:
+            self.suffix += os.path.sep + parameter_type.file_name
+        else:
+            # the last segment is part of the file name, not a directory
+            segment_regexes = [regexes[:-1] for regexes in segment_regexes]
+        self.suffix += parameter_type.file_ending
+        # for every alternative, one regex for each directory level a matching path goes through
+        self._directory_regexes = segment_regexes
+
+        self.regex = re.compile(
+            re.escape(self.prefix) + "(?:" + "|".join(regex_alternatives) + ")" + re.escape(self.suffix)
+        )
+
+    def __repr__(self):
+        return f"PathParser({self.parameter_type.__name__}, {self.regex.pattern!r})"
+
+    def parse(self, path):
+        """Returns an object created from the path, or None if the path does not match"""
+        match = self.regex.fullmatch(path)
+        if match is None:
+            return None
+
+        for sentinel, group_names, coercers, build in self._alternatives:
+            if match.group(sentinel) is not None:
+                return build(iter([coerce(match.group(name)) for name, coerce in zip(group_names, coercers)]))
+
+    def parse_many(self, paths, skip_invalid=False):
+        """
+        Returns a list of objects, one for every path.
+        If skip_invalid is True, paths that don't match are left out instead of raising.
+        """
+        objects = []
+        for path in paths:
+            obj = self.parse(path)
+            if obj is None:
+                assert skip_invalid, f"Path {path} is not a valid path for {self.parameter_type} (should match {self.regex.pattern})"
+                continue
+            objects.append(obj)
+        return objects
+
+    def scan(self):
+        """
+        Walks the data folder (the prefix of the paths) once and yields (path, object) for every
+        file that matches. Directories that cannot be part of a matching path are not entered.
+        """
+        for _, path, obj in scan_many([self]):
+            yield path, obj
+
+
+def scan_many(parsers):
+    """
+    Walks the data folder once for all the parsers, which must have the same prefix, and yields
+    (i, path, object) for every file that parser i matches. Directories are only entered if they
+    can be part of a path matching one of the parsers.
+    """
+    prefixes = {parser.prefix for parser in parsers}
+    assert len(prefixes) <= 1, f"Can only scan with parsers for one data folder, not {prefixes}"
+    if len(parsers) == 0:
+        return
+    prefix = parsers[0].prefix
+    assert prefix == "" or prefix.endswith(os.path.sep), \
+        f"Can only scan when the data folder ends with {os.path.sep}, not {prefix}"
+    root = prefix if prefix != "" else os.curdir
+    if not os.path.isdir(root):
+        return
+    candidates = [(i, alternative) for i, parser in enumerate(parsers) for alternative in range(len(parser._directory_regexes))]
+    yield from _scan_directory(parsers, root, prefix, candidates, 0)
+
+
+def _scan_directory(parsers, directory, path_prefix, candidates, depth):
+    # candidates are (parser, alternative) pairs that paths through this directory can still match
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+
+    for entry in entries:
+        if entry.is_dir():
+            possible = [(i, a) for i, a in candidates
+                        if depth < len(parsers[i]._directory_regexes[a]) and parsers[i]._directory_regexes[a][depth].fullmatch(entry.name)]
+            if len(possible) > 0:
+                yield from _scan_directory(parsers, entry.path, path_prefix + entry.name + os.path.sep, possible, depth + 1)
+        else:
+            path = path_prefix + entry.name
+            for i in dict.fromkeys(i for i, a in candidates if len(parsers[i]._directory_regexes[a]) == depth):
+                obj = parsers[i].parse(path)
+                if obj is not None:
+                    yield i, path, obj
+
+
+def _alternatives(parameter_type):
+    """
+    Returns every way an object of parameter_type can be laid out as path segments.
+
+    Each alternative is a tuple (leaves, build) where leaves is a list of (regex, coerce), one for each
+    path segment, and build creates the object from an iterator over the coerced segment values.
+    """
+    fields = parameter_type.fields()
+    per_field = [_type_alternatives(field.type) for field in fields]
+    alternatives = []
+    for combination in itertools.product(*per_field):
+        leaves = [leaf for field_leaves, _ in combination for leaf in field_leaves]
+        builders = [(field.name, build) for field, (_, build) in zip(fields, combination)]
+        alternatives.append((leaves, functools.partial(_build_object, parameter_type, builders)))
+    return alternatives
+
+
+def _type_alternatives(type):
+    if is_parameter_type(type):
+        return _alternatives(type)
+    elif get_origin(type) == Union and any(is_parameter_type(t) for t in get_args(type)):
+        return [alternative for t in get_args(type) for alternative in _type_alternatives(t)]
+    return [([(type_to_regex(type), coercer(type))], next)]
+
+
+def _build_object(parameter_type, builders, values):
+    return parameter_type(**{name: build(values) for name, build in builders})
+
+
+def coercer(type):
+    """Returns a function that converts a string from a path to a value of the given type"""
+    if type in (int, float, str):
+        return type
+    elif get_origin(type) == Literal:
+        values = {str(arg): arg for arg in get_args(type)}
+        return values.__getitem__
+    elif get_origin(type) == Union:
+        members = [(re.compile(type_to_regex(t)), coercer(t)) for t in get_args(type)]
+
+        def coerce_union(string):
+            for regex, coerce in members:
+                if regex.fullmatch(string):
+                    return coerce(string)
+            raise ValueError(f"{string} is not a valid value for {type}")
+
+        return coerce_union
+
+    raise Exception("Invalid type %s" % type)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_parser(parameter_type, schema_generation, data_folder):
+    """Compiled parsers are cached for every class, schema generation and data folder"""
+    return PathParser(parameter_type, data_folder)
@@ -0,0 +1,110 @@
+import functools
+import numbers
+import os
+from typing import get_origin, get_args, Literal
+from snakehelp.snakehelp import validate_many
+
+
+class PathTemplate:
+    """
+    A compiled path for a @parameters class.
+
+    Everything that is fixed for the class (data folder, Literals with a single value,
+    file name and file ending) is resolved once when the template is compiled, leaving
+    one slot for every parameter that varies. Paths are rendered with a precompiled format string.
+
+    >>> from snakehelp import parameters
+    >>> @parameters
+    ... class Reads:
+    ...     n_reads: int
+    ...     read_length: int
+    ...     file_ending = ".fq"
+    >>> Reads.template().render_many(n_reads=[100, 200], read_length=150)
+    ['100/150.fq', '200/150.fq']
+    """
+    def __init__(self, parameter_type, data_folder=""):
+        self.parameter_type = parameter_type
+        schema = parameter_type.schema()
+        self._types = {field.name: field.type for field in schema.get_fields()}
+        self._validators = schema.validators
+
+        parts = []
+        slots = []
+        if data_folder != "":
+            parts.append(_escape(data_folder.replace(os.path.sep, "")))
+
+        for field in schema.get_fields():
+            if get_origin(field.type) == Literal and len(get_args(field.type)) == 1:
+                parts.append(_escape(str(get_args(field.type)[0])))
+            else:
+                parts.append("{%d}" % len(slots))
+                slots.append(field.name)
+
+        if parameter_type.file_name is not None:
+            parts.append(_escape(parameter_type.file_name))
+
+        self.slots = tuple(slots)
+        self.format_string = os.path.sep.join(parts) + _escape(parameter_type.file_ending)
+        self._format = self.format_string.format
+
+    def __repr__(self):
+        return f"PathTemplate({self.parameter_type.__name__}, {self.format_string!r})"
+
+    def render(self, **values):
+        """Returns a single path. All slots must be given a value."""
+        return self.render_many(**{name: [value] for name, value in values.items()})[0]
+
+    def render_many(self, **columns):
+        """
+        Returns one path for every row in the given columns.
+
+        Each keyword argument is a parameter name and a list (or any sequence) of values. All
+        columns must have the same length. Scalar values are used for every row.
+        Every value is validated against its field type once, no matter how many rows it is used in.
+        """
+        missing = [name for name in self.slots if name not in columns]
+        assert len(missing) == 0, f"Missing values for parameters {missing} when rendering paths for {self.parameter_type}"
+
+        n_rows = None
+        for name, column in columns.items():
+            assert name in self._types, \
+                "Trying to render field '%s' which is not among the available fields which are %s" % (name, list(self._types))
+            if _is_scalar(column):
+                continue
+            if n_rows is None:
+                n_rows = len(column)
+            assert len(column) == n_rows, f"All columns must have the same length. Column {name} has length {len(column)}, expected {n_rows}"
+
+        if n_rows is None:
+            n_rows = 1
+
+        for name, column in columns.items():
+            values = [column] if _is_scalar(column) else column
+            for value, is_valid in zip(values, validate_many(values, self._types[name], self._validators[name])):
+                assert is_valid, \
+                    f"Trying to set field {name} to value {value}, " \
+                    f"but this is not compatible with the field type {self._types[name]}."
+
+        ordered_columns = [
+            [columns[name]] * n_rows if _is_scalar(columns[name]) else columns[name]
+            for name in self.slots
+        ]
+        if len(ordered_columns) == 0:
+            return [self._format()] * n_rows
+
+        return list(map(self._format, *ordered_columns))
+
+
+def _is_scalar(value):
+    # numbers.Number also covers numpy scalars
+    return isinstance(value, (str, numbers.Number))
+
+
+def _escape(string):
+    return string.replace("{", "{{").replace("}", "}}")
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(parameter_type, schema_generation, data_folder):
+    """Compiled templates are cached for every class, schema generation and data folder"""
+    return PathTemplate(parameter_type, data_folder)
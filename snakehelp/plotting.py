@@ -1,31 +1,59 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from .parameters import ParameterLike, ResultLike
 from typing import Literal
-import plotly.express as px
-import tabulate
 
-from snakehelp.parameter_combinations import ParameterCombinations
+from snakehelp.parameter_combinations import ParameterCombinations, CollectionPlanner
+from snakehelp.registry import registered_classes
 
 
 #from .parameter_combinations import ParameterCombinations
 
+# names of the plotly.express functions used for each plot type. plotly is only imported when plotting
 plotting_functions = {
-    "bar": px.bar,
-    "line": px.line,
-    "scatter": px.scatter,
-    "scat": px.scatter,
-    "box": px.box,
-    "violin": px.violin
+    "bar": "bar",
+    "line": "line",
+    "scatter": "scatter",
+    "scat": "scatter",
+    "box": "box",
+    "violin": "violin",
+    "density": "density_heatmap"
 }
 
+# scatter plots with more points than this are drawn with WebGL or binned (see PlotType.large_scatter)
+LARGE_SCATTER_THRESHOLD = 10000
+
+# the only dimensions density heatmaps can show, other dimensions (color, markers, text) are left out
+DENSITY_DIMENSIONS = ("x", "y", "facet_col", "facet_row")
+
+QUANTILES = [0, 0.25, 0.5, 0.75, 1]
+
+
+def get_plotting_function(plot_type):
+    import plotly.express as px
+    assert plot_type in plotting_functions, "Plot type %s not supported" % plot_type
+    return getattr(px, plotting_functions[plot_type])
+
+
+DIMENSIONS = ("x", "y", "facet_col", "facet_row", "color", "labels")
+
 
 @dataclass
 class PlotType:
     """
     Defines a plot type. x, y, etc are either strings referring to a field of any @parameter-marked class OR
     a the class of a @result-marked class.
+
+    aggregate can be mean, median or quantiles. Then results are aggregated over the parameters in aggregate_over
+    (by default all parameters that are given data but are not dimensions of the plot, e.g. random_seed) before plotting.
+    quantiles gives the min, quartiles and max (five rows for each group), which is enough to draw a box plot.
+
+    large_scatter decides how scatter plots with many points are drawn: webgl or density (binned in a heatmap).
     """
-    type: Literal["bar", "line", "scatter", "box", "violin"] = "bar"
+    type: Literal["bar", "line", "scatter", "box", "violin", "density"] = "bar"
     x: str = None
     y: str = None
     facet_col: str = None
@@ -35,12 +63,37 @@ class PlotType:
     markers: bool = False
     layout: dict = None
     text: str = None
+    aggregate: Literal["mean", "median", "quantiles"] = None
+    aggregate_over: list = None
+    large_scatter: Literal["webgl", "density"] = "webgl"
 
     def __post_init__(self):
         self._validate()
 
     @classmethod
-    def from_yaml_dict(cls, yaml_dict):
+    def from_yaml_dict(cls, yaml_dict, classes=None):
+        """
+        Creates a PlotType from a dict read from YAML. Dimensions that are the name of a @result class
+        among classes (all registered classes by default) are replaced by the class.
+        """
+        if classes is None:
+            classes = registered_classes()
+        result_classes = {}
+        for c in classes:
+            if issubclass(c, ResultLike):
+                result_classes.setdefault(c.__name__, []).append(c)
+
+        def find_class(value):
+            if value not in result_classes:
+                return value
+            matches = result_classes[value]
+            assert len(matches) == 1, f"Found {len(matches)} result classes named {value}: {matches}. Give the classes to use"
+            return matches[0]
+
+        yaml_dict = {
+            name: find_class(value) if name in DIMENSIONS and isinstance(value, str) else value
+            for name, value in yaml_dict.items()
+        }
         return cls(**yaml_dict)
 
     def result_types(self):
@@ -72,6 +125,13 @@ class PlotType:
         for parameter in parameter_types:
             assert parameter in parameters, f"Parameter {parameter} is not a valid parameter for generating {result_types[0]}. Valid parameters are {parameters}"
 
+        assert self.aggregate in (None, "mean", "median", "quantiles"), f"Invalid aggregate {self.aggregate}. Must be mean, median or quantiles"
+        assert self.aggregate_over is None or self.aggregate is not None, "aggregate_over requires aggregate to be set"
+        for parameter in self.aggregate_over or []:
+            assert parameter in parameters, f"Cannot aggregate over {parameter}, which is not a parameter of {result_types[0]}. Valid parameters are {parameters}"
+            assert parameter not in parameter_types, f"Cannot aggregate over {parameter}, which is a dimension of the plot"
+        assert self.large_scatter in ("webgl", "density"), f"Invalid large_scatter {self.large_scatter}. Must be webgl or density"
+
     def dimensions(self):
         dim = {
             "x": self.x,
@@ -108,18 +168,29 @@ class Plot:
     def file_names(self):
         return self._parameter_combinations.get_files(**self._data)
 
-    def plot(self, pretty_names_func=None):
-        df = self._parameter_combinations.get_results_dataframe(**self._data)
-        df.to_csv(self._out_base_name + ".csv", index=False)
-
-        markdown_table = tabulate.tabulate(df, headers=df.columns, tablefmt="github")
-        with open(self._out_base_name + ".txt", "w") as f:
-            f.write(markdown_table + "\n")
-
-        title = ""
-        if "title" in self._data:
-            title = self._data["title"]
-
+    def collect(self, workers=1, cache=None):
+        """
+        Returns a Pandas Dataframe with the results that are plotted, aggregated if the plot type has aggregate set.
+        workers and cache are used as options of get_results_dataframe.
+        """
+        return self.aggregate(self._parameter_combinations.with_options(workers=workers, cache=cache).get_results_dataframe(**self._data))
+
+    def aggregate(self, df):
+        """Returns the results in df aggregated as specified by the plot type (or df if there is nothing to aggregate)"""
+        if self._plot_type.aggregate is None:
+            return df
+
+        over = self._plot_type.aggregate_over
+        if over is None:
+            over = [name for name in self._data if name not in self._plot_type.parameter_types()]
+        result_names = [result_type.__name__ for result_type in self._plot_type.result_types()]
+        return aggregate_results(df, self._plot_type.aggregate, over, result_names)
+
+    def figure_spec(self):
+        """
+        Returns what render_figure needs to know about the plot, as a dict of plain values
+        (no classes) so that it can be sent to other processes.
+        """
         specification = {}
         for dimension, value in self._plot_type.dimensions().items():
             if type(value) != str and issubclass(value, ParameterLike):
@@ -131,25 +202,188 @@ class Plot:
             assert self._plot_type.labels is not None, "When markers: True, you need to define labels in the plot config"
             specification["text"] = self._plot_type.labels
 
-        assert self._plot_type.type in plotting_functions, "Plot type %s not supported" % self._plot_type.type
-        func = plotting_functions[self._plot_type.type]
-        fig = func(df, **specification, template="simple_white", title=title)
+        title = ""
+        if "title" in self._data:
+            title = self._data["title"]
 
-        # prettier facet titles, names, etc
-        if pretty_names_func is not None:
-            fig.for_each_annotation(lambda a: a.update(text=pretty_names_func(a.text.split("=")[-1])))
-            fig.for_each_xaxis(lambda a: a.update(title_text=pretty_names_func(a.title.text.split("=")[-1])))
-            fig.for_each_yaxis(lambda a: a.update(title_text=pretty_names_func(a.title.text.split("=")[-1])))
-            fig.for_each_trace(lambda t: t.update(name=pretty_names_func(t.name)))
+        return {"type": self._plot_type.type, "specification": specification, "title": title, "layout": self._plot_type.layout,
+                "large_scatter": self._plot_type.large_scatter}
+
+    def plot(self, pretty_names_func=None, show=True, workers=1, force=False, formats=("png", "html")):
+        """
+        Writes the results to <out_base_name>.csv and .txt, and the plot to every format (.png and .html by default).
+        The plot is also shown if show is True. Results are read with the given number of workers.
+        Nothing is written if the data and plot type are the same as last time (see render_figure), unless force is True.
+        """
+        return render_figure(self.collect(workers), self.figure_spec(), self._out_base_name, pretty_names_func, show,
+                             formats=formats, force=force)
+
+    def watch(self, render_interval=60.0, formats=("html",), pretty_names_func=None, **watch_kwargs):
+        """
+        Follows the results of the plot while they are being made (see ParameterCombinations.watch, which
+        watch_kwargs are given to as options) and yields the plotted dataframe for every update. The plot is written again
+        when at least render_interval seconds have passed since it was last written, and when watching stops.
+        Only html is written by default, since png exports are slow.
+        """
+        import time
+        last_render = None
+        df = None
+        rendered = True
+        for df in self._parameter_combinations.with_options(**watch_kwargs).watch(**self._data):
+            df = self.aggregate(df)
+            rendered = False
+            if last_render is None or time.monotonic() - last_render >= render_interval:
+                render_figure(df, self.figure_spec(), self._out_base_name, pretty_names_func, formats=formats)
+                last_render = time.monotonic()
+                rendered = True
+            yield df
+
+        if not rendered:
+            render_figure(df, self.figure_spec(), self._out_base_name, pretty_names_func, formats=formats)
+
+
+def aggregate_results(df, method, over, result_names):
+    """
+    Aggregates the result columns with method (mean, median or quantiles) over the parameter columns in over,
+    grouping by all other parameter columns. With quantiles, there are five rows for each group
+    (see QUANTILES) and a column quantile.
+    """
+    import pandas as pd
+    df = df.drop(columns=list(over))
+    for name in result_names:
+        df[name] = pd.to_numeric(df[name])
+    keys = [column for column in df.columns if column not in result_names]
+
+    if method == "quantiles":
+        if len(keys) == 0:
+            return df[result_names].quantile(QUANTILES).rename_axis("quantile").reset_index()
+        aggregated = df.groupby(keys, sort=False, dropna=False, observed=True)[result_names].quantile(QUANTILES)
+        aggregated.index = aggregated.index.set_names("quantile", level=-1)
+        return aggregated.reset_index()
+
+    if len(keys) == 0:
+        return df[result_names].agg(method).to_frame().T
+    return df.groupby(keys, sort=False, dropna=False, observed=True)[result_names].agg(method).reset_index()
+
+
+def content_hash(df, figure_spec, pretty_names_func=None, formats=("png", "html")):
+    """Returns a hash of everything that an exported figure depends on"""
+    import pandas as pd
+    h = hashlib.sha256()
+    h.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes)), figure_spec, list(formats),
+                         None if pretty_names_func is None else pretty_names_func.__module__ + "." + pretty_names_func.__qualname__],
+                        sort_keys=True, default=str).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def render_figure(df, figure_spec, out_base_name, pretty_names_func=None, show=False, formats=("png", "html"), force=False):
+    """
+    Writes the dataframe to <out_base_name>.csv and .txt and the figure to <out_base_name>.<format>
+    for every format. figure_spec is given by Plot.figure_spec.
 
-        if "text" in specification:
-            fig.update_traces(textposition="bottom right")
+    A hash of the dataframe and figure spec is written to <out_base_name>.hash. If the hash is the
+    same as last time and all the outputs exist, nothing is written unless force is True (the figure
+    is still shown if show is True). Returns True if the outputs were written, False if they were up to date.
+    """
+    import tabulate
+    hash_file_name = out_base_name + ".hash"
+    outputs = [out_base_name + ".csv", out_base_name + ".txt"] + [out_base_name + "." + format for format in formats]
+    digest = content_hash(df, figure_spec, pretty_names_func, formats)
+    if not force and all(os.path.exists(output) for output in outputs + [hash_file_name]):
+        with open(hash_file_name) as f:
+            if f.read().strip() == digest:
+                if show:
+                    make_figure(df, figure_spec, pretty_names_func).show()
+                return False
+
+    df.to_csv(out_base_name + ".csv", index=False)
+
+    markdown_table = tabulate.tabulate(df, headers=df.columns, tablefmt="github")
+    with open(out_base_name + ".txt", "w") as f:
+        f.write(markdown_table + "\n")
+
+    fig = make_figure(df, figure_spec, pretty_names_func)
+    if show:
+        fig.show()
+    for format in formats:
+        if format == "html":
+            fig.write_html(out_base_name + ".html")
+        else:
+            fig.write_image(out_base_name + "." + format)
+
+    # written last, so that outputs from a render that failed halfway are redone
+    with open(hash_file_name, "w") as f:
+        f.write(digest + "\n")
+    return True
+
+
+def make_figure(df, figure_spec, pretty_names_func=None):
+    """Returns the plotly figure for the dataframe. figure_spec is given by Plot.figure_spec"""
+    specification = figure_spec["specification"]
+    plot_type = figure_spec["type"]
+    if plotting_functions[plot_type] == "scatter" and len(df) > LARGE_SCATTER_THRESHOLD:
+        if figure_spec["large_scatter"] == "density":
+            plot_type = "density"
+        else:
+            specification = dict(specification, render_mode="webgl")
+    if plotting_functions[plot_type] == "density_heatmap":
+        specification = {name: value for name, value in specification.items() if name in DENSITY_DIMENSIONS}
+    fig = get_plotting_function(plot_type)(df, **specification, template="simple_white", title=figure_spec["title"])
+
+    # prettier facet titles, names, etc
+    if pretty_names_func is not None:
+        fig.for_each_annotation(lambda a: a.update(text=pretty_names_func(a.text.split("=")[-1])))
+        fig.for_each_xaxis(lambda a: a.update(title_text=pretty_names_func(a.title.text.split("=")[-1])))
+        fig.for_each_yaxis(lambda a: a.update(title_text=pretty_names_func(a.title.text.split("=")[-1])))
+        fig.for_each_trace(lambda t: t.update(name=pretty_names_func(t.name)))
+
+    if "text" in specification:
+        fig.update_traces(textposition="bottom right")
+
+    # fig.update_annotations(font=dict(size=20))
+    # fig.update_layout(font=dict(size=20))
+    if figure_spec["layout"] is not None:
+        fig.update_layout(**figure_spec["layout"])
+
+    return fig
+
+
+def collect_plots(specs, workers=1):
+    """
+    Returns Plot objects for the specs (Plot objects or tuples (plot_type, out_base_name, data)) and the
+    dataframe of each plot. The results are collected together with a CollectionPlanner, so every distinct
+    result file is read once (with workers threads) and each plot gets its rows from the shared frames.
+    """
+    plots = [spec if isinstance(spec, Plot) else Plot(spec[0], spec[1], **spec[2]) for spec in specs]
 
-        # fig.update_annotations(font=dict(size=20))
-        # fig.update_layout(font=dict(size=20))
-        if self._plot_type.layout is not None:
-            fig.update_layout(**self._plot_type.layout)
+    planner = CollectionPlanner()
+    for plot in plots:
+        planner.add(plot._parameter_combinations, **plot._data)
+    return plots, [plot.aggregate(df) for plot, df in zip(plots, planner.collect(workers))]
 
-        fig.show()
-        fig.write_image(self._out_base_name + ".png")
-        fig.write_html(self._out_base_name + ".html")
+
+def render_plots(specs, workers=1, headless=True, pretty_names_func=None, formats=("png", "html"), force=False):
+    """
+    Renders many plots. specs are Plot objects or tuples (plot_type, out_base_name, data) where data is a dict.
+
+    The results are collected with collect_plots, so every result file is read once.
+    In headless mode, figures are never shown and are rendered and exported in a pool of workers processes
+    (pretty_names_func must then be a module-level function so that it can be sent to the processes).
+    Otherwise, figures are rendered one by one in this process so that they can be shown.
+    Plots whose data and plot type have not changed are not written again unless force is True (see render_figure).
+    Returns the Plot objects and a list of whether each plot was written.
+    """
+    plots, dataframes = collect_plots(specs, workers)
+    jobs = [(df, plot.figure_spec(), plot._out_base_name) for plot, df in zip(plots, dataframes)]
+
+    if headless and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(render_figure, df, figure_spec, out_base_name, pretty_names_func, False, formats, force)
+                       for df, figure_spec, out_base_name in jobs]
+            rendered = [future.result() for future in futures]
+    else:
+        rendered = [render_figure(df, figure_spec, out_base_name, pretty_names_func, not headless, formats, force)
+                    for df, figure_spec, out_base_name in jobs]
+
+    return plots, rendered
@@ -0,0 +1,79 @@
+"""
+Registry of all classes created with the @parameters and @result decorators,
+used to generate global Snakemake wildcard constraints.
+"""
+_registered = {}
+_version = 0
+_constraints_cache = (None, None)
+
+
+def register(cls, module):
+    """Registers a class. A class with the same module and name replaces an earlier one (e.g. when a Snakefile is re-read)."""
+    global _version
+    _registered[(module, cls.__qualname__)] = cls
+    _version += 1
+
+
+def unregister(cls):
+    """Removes a class from the registry, e.g. a class derived from a registered class that has the same name"""
+    global _version
+    for key in [key for key, registered in _registered.items() if registered is cls]:
+        del _registered[key]
+    _version += 1
+
+
+def registered_classes():
+    """Returns all classes made with @parameters or @result, in the order they were defined"""
+    return list(_registered.values())
+
+
+def _collect_constraints(classes):
+    regexes = {}
+    for cls in classes:
+        for name, regex in cls.schema().wildcards.items():
+            regexes.setdefault(name, [])
+            if regex not in regexes[name]:
+                regexes[name].append(regex)
+    return regexes
+
+
+def conflicting_wildcards(classes=None):
+    """
+    Returns a dict from wildcard name to the list of different regexes that are used for the wildcard
+    by different classes. These wildcards cannot be constrained globally and keep their regex inline.
+    """
+    if classes is None:
+        classes = registered_classes()
+    return {name: regexes for name, regexes in _collect_constraints(classes).items() if len(regexes) > 1}
+
+
+def wildcard_constraints(classes=None):
+    """
+    Returns a dict from wildcard name to regex for all wildcards that have the same regex in every
+    class (all registered classes by default). Can be used directly in a Snakefile:
+
+        wildcard_constraints: **wildcard_constraints()
+    """
+    global _constraints_cache
+    if classes is None:
+        classes = registered_classes()
+        # the schema generation changes when union choices change, which can change the wildcards
+        key = (_version, tuple(cls.schema().generation for cls in classes))
+        if _constraints_cache[0] == key:
+            return _constraints_cache[1]
+        constraints = wildcard_constraints(classes)
+        _constraints_cache = (key, constraints)
+        return constraints
+
+    return {name: regexes[0] for name, regexes in _collect_constraints(classes).items() if len(regexes) == 1}
+
+
+def wildcard_constraints_block(classes=None):
+    """
+    Returns a global wildcard_constraints: block for a Snakefile, with one deduplicated
+    constraint for every wildcard (see wildcard_constraints).
+    """
+    lines = ["wildcard_constraints:"]
+    for name, regex in wildcard_constraints(classes).items():
+        lines.append(f"    {name}={regex!r},")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,112 @@
+"""
+Writes many plots to one self-contained HTML file.
+
+plotly.js is embedded once for the whole report, and every plot only adds its figure JSON and its data table,
+gzipped and base64-encoded. Tables are decompressed in the browser (with DecompressionStream) when they are
+opened, and figures are drawn when they are scrolled into view, so that the size and load time of the
+report depend on the data and not on the number of plots.
+"""
+import base64
+import gzip
+import html
+import json
+import os
+from .plotting import collect_plots, make_figure
+
+REPORT_STYLE = """
+body { font-family: sans-serif; margin: 2em auto; max-width: 1200px; }
+nav a { margin-right: 1em; }
+section { margin-bottom: 3em; }
+.plot { min-height: 450px; }
+table { border-collapse: collapse; font-size: 0.9em; }
+td, th { border: 1px solid #ccc; padding: 0.2em 0.5em; }
+"""
+
+REPORT_SCRIPT = """
+async function decodeTable(data) {
+    const bytes = Uint8Array.from(atob(data), c => c.charCodeAt(0));
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+    return JSON.parse(await new Response(stream).text());
+}
+
+function tableElement(table) {
+    const element = document.createElement("table");
+    const header = element.insertRow();
+    for (const column of table.columns) {
+        const cell = document.createElement("th");
+        cell.textContent = column;
+        header.appendChild(cell);
+    }
+    for (const row of table.data) {
+        const tableRow = element.insertRow();
+        for (const value of row) {
+            tableRow.insertCell().textContent = value === null ? "" : value;
+        }
+    }
+    return element;
+}
+
+const observer = new IntersectionObserver(entries => {
+    for (const entry of entries) {
+        if (entry.isIntersecting) {
+            const i = Number(entry.target.dataset.figure);
+            Plotly.newPlot(entry.target, figures[i].data, figures[i].layout, {responsive: true});
+            observer.unobserve(entry.target);
+        }
+    }
+}, {rootMargin: "500px"});
+document.querySelectorAll("div[data-figure]").forEach(element => observer.observe(element));
+
+document.querySelectorAll("details[data-table]").forEach(details => details.addEventListener("toggle", async () => {
+    if (!details.open || details.dataset.loaded) {
+        return;
+    }
+    details.dataset.loaded = "true";
+    details.appendChild(tableElement(await decodeTable(tables[Number(details.dataset.table)])));
+}));
+"""
+
+
+def _escape_script(json_string):
+    # a </script> inside the JSON would end the script element
+    return json_string.replace("</", "<\\/")
+
+
+def compress_table(df):
+    """Returns the dataframe as gzipped JSON ({"columns": [...], "data": [[...], ...]}), base64-encoded"""
+    data = df.to_json(orient="split", index=False).encode()
+    return base64.b64encode(gzip.compress(data, mtime=0)).decode()
+
+
+def write_report(specs, out_file, title="Report", workers=1, pretty_names_func=None):
+    """
+    Writes one HTML file with all the plots. specs are Plot objects or tuples (plot_type, out_base_name, data)
+    as for render_plots. Each plot is named by the last part of its out_base_name.
+    The results are collected with collect_plots, so every result file is read once.
+    """
+    from plotly.offline import get_plotlyjs
+
+    plots, dataframes = collect_plots(specs, workers)
+    names = [os.path.basename(plot._out_base_name) for plot in plots]
+    figures = "[" + ",".join(make_figure(df, plot.figure_spec(), pretty_names_func).to_json() for plot, df in zip(plots, dataframes)) + "]"
+    tables = [compress_table(df) for df in dataframes]
+
+    sections = []
+    for i, name in enumerate(names):
+        sections.append(
+            f'<section id="{html.escape(name)}"><h2>{html.escape(name)}</h2>'
+            f'<div class="plot" data-figure="{i}"></div>'
+            f'<details data-table="{i}"><summary>Data ({len(dataframes[i])} rows)</summary></details></section>'
+        )
+    navigation = " ".join(f'<a href="#{html.escape(name)}">{html.escape(name)}</a>' for name in names)
+
+    with open(out_file, "w") as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">")
+        f.write(f"<title>{html.escape(title)}</title><style>{REPORT_STYLE}</style>\n")
+        f.write(f"<script>{get_plotlyjs()}</script>\n</head><body>\n")
+        f.write(f"<h1>{html.escape(title)}</h1><nav>{navigation}</nav>\n")
+        f.write("\n".join(sections))
+        f.write(f"\n<script>\nconst figures = {_escape_script(figures)};\nconst tables = {_escape_script(json.dumps(tables))};\n")
+        f.write(REPORT_SCRIPT)
+        f.write("</script>\n</body></html>\n")
+    return plots
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+from .config import get_data_folder
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ResultIndex:
+    """
+    A persistent SQLite index of result files.
+
+    There is one table per result class, keyed by the path of the result file, storing the file's
+    mtime and size, the parsed value and one column per flat parameter. When fetching, only files
+    whose mtime or size has changed since they were indexed are read again.
+    If the parameters of a result class have changed since its table was made, the table is rebuilt.
+
+    Can be used as a context manager, which closes the index.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = get_data_folder() + ".snakehelp_index.sqlite"
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._tables = set()
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _table(self, result_type):
+        name = result_type.__name__
+        if name not in self._tables:
+            columns = ["path", "mtime_ns", "size", "value"] + list(result_type.parameters)
+            existing = [row[1] for row in self._connection.execute(f"PRAGMA table_info({_quote(name)})")]
+            with self._connection:
+                if len(existing) > 0 and existing != columns:
+                    # the result class has changed, the index is only a cache so it is made again
+                    self._connection.execute(f"DROP TABLE {_quote(name)}")
+                parameter_columns = "".join(", " + _quote(parameter) for parameter in result_type.parameters)
+                self._connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {_quote(name)} "
+                    f"(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, value{parameter_columns})"
+                )
+            self._tables.add(name)
+        return _quote(name)
+
+    def _indexed(self, table, files):
+        indexed = {}
+        # sqlite limits the number of variables in a query
+        chunk_size = 500
+        for start in range(0, len(files), chunk_size):
+            chunk = files[start:start + chunk_size]
+            rows = self._connection.execute(
+                f"SELECT path, mtime_ns, size, value FROM {table} WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for path, mtime_ns, size, value in rows:
+                indexed[path] = (mtime_ns, size, value)
+        return indexed
+
+    def fetch(self, result_objects, workers=1, executor="thread"):
+        """
+        Returns the values of the given result objects (all of the same result class), in the same order,
+        and a dict from file name to exception for results that could not be read (their value is None).
+        Files that are unchanged since they were indexed are not read.
+        """
+        from .parameter_combinations import fetch_results
+
+        if len(result_objects) == 0:
+            return [], {}
+
+        result_type = result_objects[0].__class__
+        table = self._table(result_type)
+        files = [o.file_path() for o in result_objects]
+        indexed = self._indexed(table, files)
+
+        values = [None] * len(files)
+        errors = {}
+        changed = []
+        for i, file in enumerate(files):
+            try:
+                stat = os.stat(file)
+            except OSError as e:
+                errors[file] = e
+                continue
+
+            if file in indexed and indexed[file][:2] == (stat.st_mtime_ns, stat.st_size):
+                values[i] = indexed[file][2]
+            else:
+                changed.append((i, stat))
+
+        changed_values, changed_errors = fetch_results([files[i] for i, _ in changed], workers, executor)
+        errors.update(changed_errors)
+
+        rows = []
+        for (i, stat), value in zip(changed, changed_values):
+            if files[i] in changed_errors:
+                continue
+            values[i] = value
+            if not isinstance(value, (int, float, str)):
+                # arrays are not kept in the index, they are read every time
+                continue
+            rows.append([files[i], stat.st_mtime_ns, stat.st_size, value] + result_objects[i].flat_data())
+
+        with self._connection:
+            if len(rows) > 0:
+                self._connection.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows
+                )
+            # results that have been removed should not stay in the index
+            removed = [(file,) for file in errors if file in indexed]
+            self._connection.executemany(f"DELETE FROM {table} WHERE path = ?", removed)
+
+        return values, errors
@@ -0,0 +1,144 @@
+import fcntl
+import numbers
+import os
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .config import get_data_folder
+
+
+class ParquetResultStore:
+    """
+    Stores results as records in a Parquet dataset instead of one small text file per result.
+
+    Every record has one column per (flat) parameter, and the result value in int_value, float_value
+    or str_value depending on its type. The dataset is partitioned by result name (one directory per
+    result class). Each stored result is written as a small fragment, and the fragments of a
+    partition are compacted into one file when there are more than compact_every of them.
+
+    Use with snakehelp.config.set_result_store to make store_result, fetch_result and
+    ParameterCombinations.get_results_dataframe use the store.
+    """
+    def __init__(self, folder=None, compact_every=100):
+        if folder is None:
+            folder = get_data_folder() + "results.parquet"
+        self.folder = folder
+        self.compact_every = compact_every
+
+    def _partition(self, result_name):
+        return os.path.join(self.folder, "result=" + result_name)
+
+    def _fragments(self, result_name):
+        partition = self._partition(result_name)
+        if not os.path.isdir(partition):
+            return []
+        return sorted(entry.path for entry in os.scandir(partition) if entry.name.endswith(".parquet"))
+
+    def _write(self, result_name, table, prefix):
+        partition = self._partition(result_name)
+        os.makedirs(partition, exist_ok=True)
+        file_name = os.path.join(partition, f"{prefix}-{uuid.uuid4().hex}.parquet")
+        # write to a hidden file first so that readers never see half-written fragments
+        tmp_file_name = os.path.join(partition, "." + os.path.basename(file_name) + ".tmp")
+        pq.write_table(table, tmp_file_name)
+        os.replace(tmp_file_name, file_name)
+
+    def append(self, result_object, value):
+        """Stores the value for the given result object."""
+        result_type = result_object.__class__
+        if getattr(value, "ndim", None) == 0 and hasattr(value, "item"):
+            # numpy scalars, e.g. np.int64 or np.float32
+            value = value.item()
+        assert isinstance(value, (numbers.Number, str)), f"Only numbers and strings can be stored in a {self.__class__.__name__}, not {type(value)}"
+        record = {name: [v] for name, v in zip(result_type.parameters, result_object.flat_data())}
+        is_int = isinstance(value, numbers.Integral) and not isinstance(value, bool)
+        is_float = isinstance(value, numbers.Real) and not isinstance(value, bool) and not is_int
+        record["int_value"] = pa.array([int(value) if is_int else None], pa.int64())
+        record["float_value"] = pa.array([float(value) if is_float else None], pa.float64())
+        record["str_value"] = pa.array([None if is_int or is_float else str(value)], pa.string())
+        record["written_at"] = pa.array([time.time_ns()], pa.int64())
+        self._write(result_type.__name__, pa.table(record), "part")
+
+        if len(self._fragments(result_type.__name__)) > self.compact_every:
+            self.compact(result_type)
+
+    def compact(self, result_type):
+        """
+        Merges all fragments for the result type into a single file, keeping only the latest value for each set of parameters.
+        Only one process compacts a partition at a time (using a lock file). If another process is already compacting,
+        this does nothing.
+        """
+        partition = self._partition(result_type.__name__)
+        os.makedirs(partition, exist_ok=True)
+        with open(os.path.join(partition, ".compact.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another process is compacting, it will include our fragments or leave them for the next compaction
+                return
+
+            fragments = self._fragments(result_type.__name__)
+            if len(fragments) <= 1:
+                return
+
+            try:
+                table = ds.dataset(fragments, format="parquet").to_table()
+            except FileNotFoundError:
+                # fragments were removed by a process that does not use the lock, leave them for the next compaction
+                return
+            # only the keys go through pandas, so that values are kept exactly as stored
+            keys = table.select(result_type.parameters + ["written_at"]).to_pandas()
+            kept = self._deduplicate(result_type, keys).index.to_numpy()
+            self._write(result_type.__name__, table.take(pa.array(kept)), "compacted")
+            for fragment in fragments:
+                try:
+                    os.remove(fragment)
+                except FileNotFoundError:
+                    pass
+
+    def _deduplicate(self, result_type, df):
+        return df.sort_values("written_at", kind="stable").drop_duplicates(subset=result_type.parameters, keep="last")
+
+    def read(self, result_type, **data):
+        """
+        Returns a Pandas Dataframe with the parameters of the result type and a column value.
+        Data can be given to only read records where parameters have the given value(s), these filters
+        are pushed down to the Parquet reader.
+        """
+        filter = None
+        # as with from_flat_params, data for other parameters is ignored
+        data = {name: values for name, values in data.items() if name in result_type.parameters}
+        for name, values in data.items():
+            if not isinstance(values, list):
+                values = [values]
+            expression = ds.field(name).isin(values)
+            filter = expression if filter is None else filter & expression
+
+        while True:
+            fragments = self._fragments(result_type.__name__)
+            if len(fragments) == 0:
+                return pd.DataFrame(columns=result_type.parameters + ["value"])
+            try:
+                # integer_object_nulls keeps int values exact instead of making them float because of missing values
+                df = ds.dataset(fragments, format="parquet").to_table(filter=filter).to_pandas(integer_object_nulls=True)
+                break
+            except FileNotFoundError:
+                # fragments were compacted while reading, list them again
+                continue
+
+        df = self._deduplicate(result_type, df)
+        value = df["int_value"].astype(object)
+        value = value.where(value.notna(), df["float_value"].astype(object))
+        df["value"] = value.where(value.notna(), df["str_value"])
+        return df[result_type.parameters + ["value"]].reset_index(drop=True)
+
+    def fetch(self, result_object):
+        """Returns the value stored for the given result object."""
+        result_type = result_object.__class__
+        df = self.read(result_type, **dict(zip(result_type.parameters, result_object.flat_data())))
+        if len(df) == 0:
+            raise KeyError(f"No result stored for {result_object} in {self.folder}")
+        return df["value"].iloc[0]
@@ -0,0 +1,45 @@
+"""
+Deterministic sharding of parameter combinations, so that one sweep can be split over many
+Snakemake invocations without duplicate or missing jobs.
+
+The shard of a combination only depends on its flat parameters (names and values as written in paths),
+never on the order of the grid, so every node computes the same shards.
+"""
+import hashlib
+
+
+def parse_shard(shard):
+    """Parses a shard given as "index/count" (e.g. "0/4") or a tuple (index, count) into a tuple of ints"""
+    if isinstance(shard, str):
+        assert shard.count("/") == 1, f"Invalid shard {shard}. Must be on the form index/count, e.g. 0/4"
+        shard = shard.split("/")
+    index, count = (int(v) for v in shard)
+    assert count >= 1 and 0 <= index < count, f"Invalid shard {index}/{count}. Index must be between 0 and count - 1"
+    return index, count
+
+
+def shard_of(names, values, count):
+    """
+    Returns the shard (0 to count - 1) of the parameters with the given names and values.
+    The parameters are sorted by name and hashed with their values as strings, so the shard is the same
+    in every process and independent of the order of the parameters.
+
+    >>> shard_of(["b", "a"], [2, "x"], 4) == shard_of(["a", "b"], ["x", "2"], 4)
+    True
+    """
+    key = "\0".join(name + "=" + str(value) for name, value in sorted(zip(names, values), key=lambda p: p[0]))
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_mask(df, names, index, count):
+    """Returns a boolean list that is True for the rows of the Dataframe that are in the given shard"""
+    return [shard_of(names, values, count) == index for values in df[list(names)].itertuples(index=False, name=None)]
+
+
+def merge_shards(dataframes):
+    """Concatenates the result Dataframes of all shards into one Dataframe"""
+    import pandas as pd
+    dataframes = list(dataframes)
+    assert len(dataframes) > 0, "No shards to merge"
+    return pd.concat(dataframes, ignore_index=True)
@@ -1,3 +1,5 @@
+import functools
+import numbers
 import os
 from collections import namedtuple
 from dataclasses import dataclass, fields
@@ -38,8 +40,8 @@ def type_to_regex(type):
             # all types are base type, we can give a regex for each
             return "|".join([type_to_regex(t) for t in get_args(type)])
         else:
-            # There is one or more objects, we can have anything
-            return ".*"
+            # There is one or more objects, match the exact path segments of each member
+            return union_regex(get_args(type))
     elif is_parameter_type(type):
         # normal parameter-objects are strings in the path
         return "\w+"
@@ -47,24 +49,142 @@ def type_to_regex(type):
     raise Exception("Invalid type %s" % type)
 
 
-def string_is_valid_type(string, type):
+_int_regex = re.compile(r"\d+")
+# the strings accepted by float()
+_float_regex = re.compile(r"\s*[+-]?((\d+\.?\d*|\.\d+)([eE][+-]?\d+)?|nan|inf|infinity)\s*", re.IGNORECASE)
+
+
+def _always_valid(value):
+    return True
+
+
+def _validate_int(value):
+    return isinstance(value, numbers.Integral) or (isinstance(value, str) and _int_regex.fullmatch(value) is not None)
+
+
+def _validate_float(value):
+    return isinstance(value, numbers.Real) or (isinstance(value, str) and _float_regex.fullmatch(value) is not None)
+
+
+def _validate_parameter_string(value):
+    return isinstance(value, str)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_validator(type):
+    """
+    Returns a function that checks whether a value (typically a string from a path
+    or wildcard) is valid for the given type. Validators are compiled once for each type.
+    """
     if type == str:
-        return True
+        return _always_valid
     elif type == int:
-        return isinstance(string, int) or string.isdigit()
+        return _validate_int
     elif type == float:
-        try:
-            float(string)
-            return True
-        except ValueError:
-            return False
+        return _validate_float
     elif get_origin(type) == Literal:
-        return string in get_args(type)
+        values = frozenset(get_args(type))
+
+        def validate_literal(value):
+            try:
+                return value in values
+            except TypeError:
+                return False
+
+        return validate_literal
     elif get_origin(type) in [Union]:
-        return any((string_is_valid_type(string, t) for t in get_args(type)))
+        validators = []
+        for t in get_args(type):
+            validator = compile_validator(t)
+            if validator is _always_valid:
+                return _always_valid
+            if validator not in validators:
+                validators.append(validator)
+
+        def validate_union(value):
+            return any(validator(value) for validator in validators)
+
+        return validate_union
     elif is_parameter_type(type):
-        return isinstance(string, str)
+        return _validate_parameter_string
     else:
         raise Exception("Type %s not implemented" % type)
 
 
+def segment_regexes(type):
+    """Returns one regex for each path segment that a value of the given type spans"""
+    if is_parameter_type(type):
+        return [type_to_regex(field.type) for field in type.get_fields()]
+    return [type_to_regex(type)]
+
+
+def union_regex(types):
+    """
+    Returns a regex matching the paths of any of the given types, which may span a different number
+    of path segments. Members sharing leading segments share a branch (a trie over the segment regexes),
+    so each member is matched deterministically and segments are never matched across path separators.
+    """
+    return sequences_to_regex([segment_regexes(type) for type in types])
+
+
+def sequences_to_regex(sequences):
+    """Returns a regex matching any of the sequences of path segment regexes, built as a trie"""
+    trie = {}
+    for sequence in sequences:
+        assert len(sequence) > 0, "Cannot make a regex for an empty sequence of path segments"
+        node = trie
+        for fragment in sequence:
+            node = node.setdefault(fragment, {})
+        # None marks that a sequence ends at this node
+        node[None] = {}
+
+    return _alternation(["(?:" + fragment + ")" + _trie_continuation(child) for fragment, child in trie.items()])
+
+
+def _trie_continuation(node):
+    separator = re.escape(os.path.sep)
+    alternatives = [separator + "(?:" + fragment + ")" + _trie_continuation(child)
+                    for fragment, child in node.items() if fragment is not None]
+    if len(alternatives) == 0:
+        return ""
+
+    regex = _alternation(alternatives)
+    if None in node:
+        regex = "(?:" + regex + ")?"
+    return regex
+
+
+def _alternation(alternatives):
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+def string_is_valid_type(string, type):
+    return compile_validator(type)(string)
+
+
+def validate_many(values, type, validator=None):
+    """
+    Returns a list of booleans telling whether each value is valid for the type.
+    Each distinct value is only validated once. A validator that has already been
+    compiled for the type (see compile_validator) can be given.
+    """
+    if validator is None:
+        validator = compile_validator(type)
+    validated = {}
+    out = []
+    for value in values:
+        # the type is part of the key since e.g. 1 and 1.0 are equal, but not equally valid
+        key = (value.__class__, value)
+        try:
+            is_valid = validated[key]
+        except KeyError:
+            is_valid = validated[key] = validator(value)
+        except TypeError:
+            # unhashable values are validated every time
+            is_valid = validator(value)
+        out.append(is_valid)
+    return out
+
+
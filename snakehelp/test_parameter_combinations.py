@@ -1,7 +1,11 @@
-from snakehelp.parameter_combinations import ParameterCombinations
+from snakehelp.parameter_combinations import ParameterCombinations, ResultFetchError, fetch_results, CollectionPlanner
+import snakehelp.parameter_combinations
 from snakehelp.parameters import parameters, result
+from snakehelp.result_index import ResultIndex
 from typing import Literal
 import itertools
+import os
+import pytest
 
 
 @parameters
@@ -42,3 +46,305 @@ def test_parameter_combinations():
     df = combinations.get_results_dataframe(read_length=[100, 150], method_name=["bwa", "minimap2"])
     print(df)
 
+
+def test_iter_combinations():
+    combinations = ParameterCombinations(["read_length", "method_name"], [Precision, Recall])
+    iterator = combinations.iter_combinations(read_length=[100, 150], method_name=["bwa", "minimap2"])
+    assert next(iterator) == [Precision(config=Config(read_length=100, method_name="bwa")),
+                              Recall(config=Config(read_length=100, method_name="bwa"))]
+    assert len(list(iterator)) == 3
+
+    files = combinations.iter_files(read_length=[100, 150], method_name="bwa")
+    assert list(files) == combinations.get_files(read_length=[100, 150], method_name="bwa")
+
+
+
+def test_scan_results_dataframe(tmp_path, monkeypatch, data_folder):
+    Precision.from_flat_params(read_length=100, method_name="bwa").store_result(0.5)
+    Precision.from_flat_params(read_length=150, method_name="bwa").store_result(0.6)
+    Recall.from_flat_params(read_length=100, method_name="bwa").store_result(0.7)
+    (tmp_path / "data" / "hg38" / "not_a_number").mkdir()
+    (tmp_path / "data" / "hg38" / "100" / "bwa" / "other.txt").write_text("1")
+
+    assert list(Precision.scan()) == [Precision.from_flat_params(read_length=100, method_name="bwa"),
+                                      Precision.from_flat_params(read_length=150, method_name="bwa")]
+
+    # the data folder is walked once for both result types
+    import snakehelp.path_parser
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(snakehelp.path_parser.os, "scandir", lambda path: scanned.append(path) or scandir(path))
+    combinations = ParameterCombinations(["read_length", "method_name"], [Precision, Recall])
+    df = combinations.scan_results_dataframe()
+    monkeypatch.undo()
+    assert len(scanned) == len(set(scanned))
+    assert len(df) == 2
+    assert df[df.read_length == 100].Recall.tolist() == [0.7]
+
+    df = combinations.scan_results_dataframe(read_length=150)
+    assert df.Precision.tolist() == [0.6]
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_get_results_dataframe_parallel(executor, data_folder):
+    for read_length in range(100, 110):
+        Precision.from_flat_params(read_length=read_length).store_result(read_length / 1000)
+        Recall.from_flat_params(read_length=read_length).store_result(read_length / 100)
+
+    combinations = ParameterCombinations(["read_length"], [Precision, Recall], workers=4, executor=executor)
+    df = combinations.get_results_dataframe(read_length=list(range(100, 110)))
+    assert df.read_length.tolist() == list(range(100, 110))
+    assert df.Precision.tolist() == [r / 1000 for r in range(100, 110)]
+    assert df.Recall.tolist() == [r / 100 for r in range(100, 110)]
+
+
+def test_get_results_dataframe_reports_all_errors(data_folder):
+    Precision.from_flat_params(read_length=100).store_result(0.5)
+    Recall.from_flat_params(read_length=100).store_result(0.5)
+    combinations = ParameterCombinations(["read_length"], [Precision, Recall], workers=2)
+
+    with pytest.raises(ResultFetchError) as e:
+        combinations.get_results_dataframe(read_length=[100, 101, 102])
+    assert len(e.value.errors) == 4
+    assert isinstance(e.value, FileNotFoundError)
+
+    with pytest.warns(UserWarning):
+        df = combinations.with_options(errors="warn").get_results_dataframe(read_length=[100, 101, 102])
+    assert df.Precision.tolist()[0] == 0.5
+    assert df.Precision.isna().tolist() == [False, True, True]
+
+
+@result
+class Speedup:
+    config: Config
+    workers: int = 1
+
+
+def test_parameters_named_like_options(data_folder):
+    for workers in (1, 2):
+        Speedup.from_flat_params(workers=workers).store_result(workers / 10)
+    combinations = ParameterCombinations(["workers"], [Speedup], workers=2)
+    assert combinations.get_results_dataframe(workers=[1, 2]).Speedup.tolist() == [0.1, 0.2]
+    assert combinations.scan_results_dataframe(workers=2).Speedup.tolist() == [0.2]
+    assert next(combinations.with_options(timeout=0).watch(workers=[1, 2])).Speedup.tolist() == [0.1, 0.2]
+    assert combinations.with_options(workers=1).options["workers"] == 1
+    with pytest.raises(AssertionError):
+        ParameterCombinations(["workers"], [Speedup], threads=2)
+
+
+def test_get_results_dataframe_with_index(tmp_path, data_folder):
+    for read_length in [100, 150]:
+        Precision.from_flat_params(read_length=read_length).store_result(0.5)
+        Recall.from_flat_params(read_length=read_length).store_result(0.6)
+
+    index = ResultIndex(str(tmp_path / "index.sqlite"))
+    combinations = ParameterCombinations(["read_length"], [Precision, Recall], index=index)
+    df = combinations.get_results_dataframe(read_length=[100, 150])
+    assert df.Precision.tolist() == [0.5, 0.5]
+
+    # unchanged files are answered by the index, without being read
+    precision = Precision.from_flat_params(read_length=100)
+    stat = os.stat(precision.file_path())
+    with open(precision.file_path(), "w") as f:
+        f.write("0.9")
+    os.utime(precision.file_path(), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    df = combinations.get_results_dataframe(read_length=[100, 150])
+    assert df.Precision.tolist() == [0.5, 0.5]
+
+    # changed files are read again
+    precision.store_result(0.7)
+    os.utime(precision.file_path(), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    df = combinations.with_options(index=str(tmp_path / "index.sqlite")).get_results_dataframe(read_length=[100, 150])
+    assert df.Precision.tolist() == [0.7, 0.5]
+    assert df.Recall.tolist() == [0.6, 0.6]
+
+
+def test_grid():
+    combinations = ParameterCombinations(["read_length", "method_name"], [Precision, Recall])
+    grid = combinations.grid(read_length=[100, 150], method_name=["bwa", "minimap2"])
+    assert grid.read_length.tolist() == [100, 100, 150, 150]
+    assert grid.param1.tolist() == ["hg38"] * 4
+
+    objects = combinations.combinations(read_length=[100, 150], method_name=["bwa", "minimap2"])
+    assert grid.Precision_file.tolist() == [row[0].file_path() for row in objects]
+    assert grid.Recall_file.tolist() == [row[1].file_path() for row in objects]
+    assert combinations.get_files(read_length=[100, 150], method_name="bwa") == \
+        list(combinations.iter_files(read_length=[100, 150], method_name="bwa"))
+
+
+@result
+class Runtime:
+    config: Config
+    n_threads: int
+
+
+def test_grid_requires_defaults():
+    assert len(ParameterCombinations([], [Runtime]).grid(n_threads=[1, 2])) == 2
+    with pytest.raises(AssertionError):
+        ParameterCombinations([], [Runtime]).grid(read_length=100)
+
+
+def test_shard():
+    data = dict(read_length=list(range(100, 120)), method_name=["bwa", "minimap2"])
+    combinations = ParameterCombinations(["read_length", "method_name"], [Precision, Recall])
+    all_files = combinations.get_files(**data)
+
+    shards = [combinations.shard(i, 3) for i in range(3)]
+    shard_files = [shard.get_files(**data) for shard in shards]
+    assert sorted(itertools.chain(*shard_files)) == sorted(all_files)
+    assert all(0 < len(files) < len(all_files) for files in shard_files)
+
+    # grid and objects agree, and the shards do not depend on the order of the data
+    assert shard_files[0] == list(shards[0].iter_files(**data))
+    reordered = shards[0].get_files(method_name=["minimap2", "bwa"], read_length=list(reversed(range(100, 120))))
+    assert sorted(reordered) == sorted(shard_files[0])
+
+    # as_output gives the same shard
+    assert sorted(Precision.iter_output(_shard="0/3", param1="hg38", **data)) == \
+        sorted(shard_files[0][::2])
+    # paths with wildcards can not be sharded like the paths they match
+    with pytest.raises(AssertionError):
+        list(Precision.iter_output(_shard="0/3", **data))
+
+    with pytest.raises(AssertionError):
+        combinations.shard(3, 3)
+
+
+def test_fetch_results_cache(tmp_path):
+    file = tmp_path / "result.txt"
+    file.write_text("1")
+    cache = {}
+    values, errors = fetch_results([str(file), str(file), str(tmp_path / "missing.txt")], cache=cache)
+    assert values == [1, 1, None]
+    assert list(errors) == [str(tmp_path / "missing.txt")]
+    assert cache == {str(file): 1}
+
+    # cached files are not read again
+    file.write_text("2")
+    assert fetch_results([str(file)], cache=cache)[0] == [1]
+
+
+def test_collection_planner(monkeypatch, data_folder):
+    for read_length in (100, 150, 200):
+        for method_name in ("bwa", "minimap2"):
+            Precision.from_flat_params(read_length=read_length, method_name=method_name).store_result(read_length / 1000)
+            Recall.from_flat_params(read_length=read_length, method_name=method_name).store_result(read_length / 100)
+
+    requests = [
+        (ParameterCombinations(["read_length"], [Precision, Recall]), dict(read_length=[100, 150, 200])),
+        (ParameterCombinations(["read_length", "method_name"], [Recall]), dict(read_length=[100, 150], method_name=["bwa", "minimap2"])),
+        (ParameterCombinations(["read_length"], [Precision]), dict(read_length=[200, 150])),
+    ]
+    expected = [combinations.get_results_dataframe(**data) for combinations, data in requests]
+
+    read_files = []
+    read_result = snakehelp.parameter_combinations.read_result
+    monkeypatch.setattr(snakehelp.parameter_combinations, "read_result", lambda file: read_files.append(file) or read_result(file))
+    planner = CollectionPlanner()
+    for combinations, data in requests:
+        planner.add(combinations, **data)
+    dataframes = planner.collect()
+
+    assert len(read_files) == len(set(read_files)) == 8
+    for df, expected_df in zip(dataframes, expected):
+        assert df.equals(expected_df)
+
+
+@result
+class Accuracy:
+    config: Config
+    region: Literal["all", "difficult"] = "all"
+    coverage: float = 10.0
+
+
+def test_index_is_rebuilt_when_parameters_change(tmp_path, data_folder):
+    import sqlite3
+    index_path = str(tmp_path / "index.sqlite")
+    # a table made when Precision had other parameters
+    with sqlite3.connect(index_path) as connection:
+        connection.execute('CREATE TABLE "Precision" (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, value, param1, read_length)')
+    Precision.from_flat_params(read_length=100).store_result(0.5)
+    combinations = ParameterCombinations(["read_length"], [Precision], index=index_path)
+    assert combinations.get_results_dataframe(read_length=100).Precision.tolist() == [0.5]
+    assert combinations.get_results_dataframe(read_length=100).Precision.tolist() == [0.5]
+
+
+def test_typed_columns(tmp_path, data_folder):
+    for read_length in (100, 150):
+        Accuracy.from_flat_params(read_length=read_length, region="difficult").store_result(read_length / 1000)
+
+    combinations = ParameterCombinations(["read_length"], [Accuracy])
+    for df in (combinations.get_results_dataframe(read_length=[100, 150], region="difficult"),
+               combinations.with_options(index=str(tmp_path / "index.sqlite")).get_results_dataframe(read_length=[100, 150], region="difficult"),
+               combinations.scan_results_dataframe()):
+        assert df.read_length.dtype == "int64"
+        assert df.coverage.dtype == "float64"
+        assert df.Accuracy.dtype == "float64"
+        assert df.method_name.dtype == "category"
+        assert list(df.region.cat.categories) == ["all", "difficult"]
+        assert df.read_length.tolist() == [100, 150]
+        assert df.Accuracy.tolist() == [0.1, 0.15]
+
+    for method_name in ("minimap2", "bwa"):
+        Accuracy.from_flat_params(method_name=method_name).store_result(0.5)
+    df = ParameterCombinations(["method_name"], [Accuracy]).get_results_dataframe(method_name=["minimap2", "bwa"])
+    assert list(df.method_name.cat.categories) == ["minimap2", "bwa"]
+
+    # values that are not integers are not truncated for int parameters (paths are not validated)
+    Accuracy.from_flat_params(read_length=1.5, region="difficult").store_result(0.5)
+    df = combinations.get_results_dataframe(read_length=[1.5, 100], region="difficult")
+    assert df.read_length.tolist() == [1.5, 100]
+
+    pa = pytest.importorskip("pyarrow")
+    table = combinations.with_options(arrow=True).get_results_dataframe(read_length=[100, 150], region="difficult")
+    assert table.column("Accuracy").to_pylist() == [0.1, 0.15]
+    assert pa.types.is_dictionary(table.schema.field("region").type)
+
+
+@pytest.mark.parametrize("use_inotify", [False, True])
+def test_watch(use_inotify, data_folder):
+    if use_inotify:
+        pytest.importorskip("inotify_simple")
+    Precision.from_flat_params(read_length=100).store_result(0.1)
+    combinations = ParameterCombinations(["read_length"], [Precision, Recall], interval=0.05, timeout=10, use_inotify=use_inotify)
+    updates = combinations.watch(read_length=[100, 150])
+
+    df = next(updates)
+    assert df.Precision.tolist()[0] == 0.1
+    assert df.Recall.isna().all()
+
+    # results in directories that do not exist yet are found too
+    Precision.from_flat_params(read_length=150).store_result(0.15)
+    Recall.from_flat_params(read_length=100).store_result(0.2)
+    df = next(updates)
+    while df.Recall.isna().all() or df.Precision.isna().any():
+        df = next(updates)
+    assert df.Precision.tolist() == [0.1, 0.15]
+
+    Recall.from_flat_params(read_length=150).store_result(0.3)
+    for df in updates:
+        pass
+    assert df.Recall.tolist() == [0.2, 0.3]
+
+
+def test_watch_timeout(data_folder):
+    updates = list(ParameterCombinations(["read_length"], [Precision], interval=0.01, timeout=0.1).watch(read_length=[100]))
+    assert len(updates) == 1
+    assert updates[0].Precision.isna().all()
+
+
+@result
+class Ratio:
+    config: Config
+    ratio: float = 1.0
+
+
+def test_grid_paths_keep_given_values(data_folder):
+    for ratio in (1, 1.5):
+        Ratio.from_flat_params(read_length=100, ratio=ratio).store_result(ratio * 2)
+
+    combinations = ParameterCombinations(["ratio"], [Ratio])
+    data = dict(read_length=100, ratio=[1, 1.5])
+    assert combinations.get_files(**data) == list(combinations.iter_files(**data))
+    assert combinations.get_files(**data)[0].endswith("/hg38/100/bwa/1/Ratio.txt")
+    assert combinations.get_results_dataframe(**data).Ratio.tolist() == [2, 3]
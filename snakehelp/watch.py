@@ -0,0 +1,89 @@
+"""
+Watches result files while a pipeline runs, so that partial results can be followed without
+collecting the whole tree again. inotify is used when inotify_simple is installed, otherwise
+the files are polled by mtime and size.
+"""
+import importlib.util
+import os
+import time
+
+
+class PollingWatcher:
+    """Finds changed files by comparing their mtime and size with the last time they were checked"""
+    def __init__(self, files):
+        self.files = files
+        self._stats = {}
+
+    def wait(self, timeout):
+        """
+        Waits at most timeout seconds for files to change. Returns the files that may have changed,
+        or None if any file may have changed.
+        """
+        time.sleep(timeout)
+        return None
+
+    def changed(self, candidates=None):
+        """Returns the files among candidates (all files if None) that have been created or changed since they were last checked"""
+        changed = []
+        for file in self.files if candidates is None else candidates:
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            key = (stat.st_mtime_ns, stat.st_size)
+            if self._stats.get(file) != key:
+                self._stats[file] = key
+                changed.append(file)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Waits for inotify events on the directories of the files instead of polling. Directories that
+    do not exist yet are watched through their closest existing parent, and are watched
+    themselves once they have been created.
+    """
+    def __init__(self, files):
+        from inotify_simple import INotify, flags
+        super().__init__(files)
+        self._inotify = INotify()
+        self._flags = flags
+        self._mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY
+        self._files_in_directory = {}
+        for file in files:
+            self._files_in_directory.setdefault(os.path.dirname(file) or os.curdir, []).append(file)
+        self._watches = {}
+        self._update_watches()
+
+    def _update_watches(self):
+        watched = set(self._watches.values())
+        for directory in self._files_in_directory:
+            while not os.path.isdir(directory):
+                directory = os.path.dirname(directory) or os.curdir
+            if directory not in watched:
+                self._watches[self._inotify.add_watch(directory, self._mask)] = directory
+                watched.add(directory)
+
+    def wait(self, timeout):
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        candidates = []
+        for event in events:
+            if event.mask & self._flags.ISDIR:
+                # a directory on the way to some files was created, watch it and check everything
+                self._update_watches()
+                return None
+            candidates.extend(self._files_in_directory.get(self._watches.get(event.wd), []))
+        return list(dict.fromkeys(candidates))
+
+    def close(self):
+        self._inotify.close()
+
+
+def file_watcher(files, use_inotify=None):
+    """Returns an InotifyWatcher if inotify_simple is available (or use_inotify is True), otherwise a PollingWatcher"""
+    if use_inotify is None:
+        use_inotify = importlib.util.find_spec("inotify_simple") is not None
+    return InotifyWatcher(files) if use_inotify else PollingWatcher(files)
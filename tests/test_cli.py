@@ -0,0 +1,147 @@
+import runpy
+import pandas as pd
+from typer.testing import CliRunner
+from snakehelp.cli import app
+
+runner = CliRunner()
+
+CLASSES = '''
+from typing import Literal
+from snakehelp import parameters, result
+
+
+@parameters
+class CliSample:
+    cli_sample_name: str = "a"
+    cli_depth: int = 10
+
+
+@result
+class CliCoverage:
+    sample: CliSample
+    cli_method: Literal["x", "y"] = "x"
+'''
+
+
+def test_codegen(tmp_path):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    result = runner.invoke(app, ["codegen", str(source)])
+    assert result.exit_code == 0, result.output
+
+    namespace = {}
+    # everything except the wildcard_constraints block is plain Python
+    exec(result.output.split("wildcard_constraints:")[1].split("\n\n", 1)[1], namespace)
+    assert namespace["CliSample_input"] == "{cli_sample_name}/{cli_depth}"
+    assert namespace["CliSample_output"] == "{cli_sample_name}/{cli_depth}"
+    assert namespace["CliCoverage_input"] == "{cli_sample_name}/{cli_depth}/{cli_method}/CliCoverage.txt"
+    assert "    cli_depth='\\\\d+'," in result.output
+    assert "    cli_method='x|y'," in result.output
+
+
+def test_codegen_to_file(tmp_path, data_folder):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    out = tmp_path / "patterns.smk"
+    result = runner.invoke(app, ["codegen", str(source), "-o", str(out), "--data-folder", "data/"])
+    assert result.exit_code == 0, result.output
+    assert "CliSample_input = 'data/{cli_sample_name}/{cli_depth}'" in out.read_text()
+
+
+def test_targets(tmp_path):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    result = runner.invoke(app, ["targets", str(source), "CliCoverage", "--param", "cli_depth=1,2", "-p", "cli_method=y"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["a/1/y/CliCoverage.txt", "a/2/y/CliCoverage.txt"]
+
+    result = runner.invoke(app, ["targets", str(source), "CliCoverage", "--param", "cli_depth=x"])
+    assert result.exit_code != 0
+
+    # every command takes --profile, and targets takes --workers like collect and plot
+    out = tmp_path / "targets.txt"
+    result = runner.invoke(app, ["targets", str(source), "CliCoverage", "-p", "cli_depth=1", "-o", str(out), "--workers", "2", "--profile"])
+    assert result.exit_code == 0, result.output
+    assert out.read_text().splitlines() == ["a/1/x/CliCoverage.txt"]
+    result = runner.invoke(app, ["codegen", str(source), "-o", str(tmp_path / "Snakefile"), "--profile"])
+    assert result.exit_code == 0, result.output
+
+
+def test_collect(tmp_path, data_folder):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    namespace = runpy.run_path(str(source))
+    for depth in (1, 2, 3):
+        namespace["CliCoverage"].from_flat_params(cli_depth=depth).store_result(depth / 10)
+
+    out = str(tmp_path / "coverage.csv")
+    result = runner.invoke(app, ["collect", str(source), "CliCoverage", "-p", "cli_depth=1,3",
+                                 "-o", out, "--data-folder", data_folder, "--workers", "2"])
+    assert result.exit_code == 0, result.output
+    df = pd.read_csv(out)
+    assert df["cli_depth"].tolist() == [1, 3]
+    assert df["CliCoverage"].tolist() == [0.1, 0.3]
+
+    out = str(tmp_path / "coverage_grid.csv")
+    result = runner.invoke(app, ["collect", str(source), "CliCoverage", "-p", "cli_depth=1,4", "--grid",
+                                 "-o", out, "--data-folder", data_folder])
+    # a result is missing
+    assert result.exit_code != 0
+
+    result = runner.invoke(app, ["collect", str(source), "CliCoverage", "-p", "cli_depth=1,2", "--grid",
+                                 "-o", out, "--data-folder", data_folder, "--profile"])
+    assert result.exit_code == 0, result.output
+    assert pd.read_csv(out)["CliCoverage"].tolist() == [0.1, 0.2]
+
+
+def test_shards(tmp_path, data_folder):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    namespace = runpy.run_path(str(source))
+    for depth in range(10):
+        namespace["CliCoverage"].from_flat_params(cli_depth=depth).store_result(depth)
+
+    depths = "cli_depth=" + ",".join(map(str, range(10)))
+    targets = []
+    shard_files = []
+    for i in range(2):
+        result = runner.invoke(app, ["targets", str(source), "CliCoverage", "-p", depths, "--shard", f"{i}/2"])
+        assert result.exit_code == 0, result.output
+        targets.extend(result.output.splitlines())
+
+        shard_files.append(str(tmp_path / f"shard{i}.csv"))
+        result = runner.invoke(app, ["collect", str(source), "CliCoverage", "-p", depths, "--grid", "--shard", f"{i}/2",
+                                     "-o", shard_files[-1], "--data-folder", data_folder])
+        assert result.exit_code == 0, result.output
+
+    assert sorted(targets) == sorted(namespace["CliCoverage"].iter_output(cli_sample_name="a", cli_depth=list(range(10)), cli_method="x"))
+
+    out = str(tmp_path / "merged.csv")
+    result = runner.invoke(app, ["merge", *shard_files, "-o", out, "--profile"])
+    assert result.exit_code == 0, result.output
+    assert sorted(pd.read_csv(out)["CliCoverage"]) == list(range(10))
+
+
+def test_plot_report(tmp_path, data_folder):
+    source = tmp_path / "classes.py"
+    source.write_text(CLASSES)
+    config = tmp_path / "plots.yaml"
+    config.write_text(
+        "plot_types:\n"
+        "  coverage_by_depth:\n"
+        "    type: line\n"
+        "    x: cli_depth\n"
+        "    y: CliCoverage\n"
+        "plots:\n"
+        "  coverage:\n"
+        "    plot_type: coverage_by_depth\n"
+        "    cli_depth: [1, 2]\n"
+    )
+    namespace = runpy.run_path(str(source))
+    for depth in (1, 2):
+        namespace["CliCoverage"].from_flat_params(cli_depth=depth).store_result(depth)
+
+    report = tmp_path / "report.html"
+    result = runner.invoke(app, ["plot", str(source), str(config), "--report", str(report), "--data-folder", data_folder])
+    assert result.exit_code == 0, result.output
+    assert '<section id="coverage">' in report.read_text()
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+# generous budget, importing snakehelp should only need the standard library
+IMPORT_TIME_BUDGET_MS = 500
+HEAVY_MODULES = ["numpy", "pandas", "plotly", "tabulate", "pyarrow", "shared_memory_wrapper"]
+
+
+def _import_in_subprocess(statement):
+    code = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        "print(json.dumps({'ms': elapsed, 'modules': sorted(sys.modules)}))\n"
+    )
+    repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+                            cwd=repository_root).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_only_loads_stdlib():
+    result = _import_in_subprocess("from snakehelp import parameters, result")
+    loaded = [module for module in HEAVY_MODULES if module in result["modules"]]
+    assert loaded == [], f"Importing snakehelp loaded {loaded}"
+
+
+def test_plotting_does_not_import_plotly():
+    result = _import_in_subprocess("import snakehelp.plotting")
+    loaded = [module for module in HEAVY_MODULES if module in result["modules"]]
+    assert loaded == [], f"Importing snakehelp.plotting loaded {loaded}"
+
+
+def test_import_time():
+    result = _import_in_subprocess("from snakehelp import parameters, result")
+    assert result["ms"] < IMPORT_TIME_BUDGET_MS, f"Importing snakehelp took {result['ms']:.0f} ms"
@@ -2,7 +2,7 @@ import os
 import pytest
 from snakehelp import parameters
 from snakehelp.parameters import result, ResultLike, ParameterLike
-from snakehelp.snakehelp import type_to_regex
+from snakehelp.snakehelp import type_to_regex, string_is_valid_type, compile_validator, validate_many
 from typing import Literal, Union
 import dataclasses
 
@@ -63,6 +63,27 @@ def test_type_to_regex():
     assert type_to_regex(int) == "\\d+"
 
 
+def test_string_is_valid_type():
+    assert string_is_valid_type("10", int)
+    assert string_is_valid_type(10, int)
+    assert not string_is_valid_type("1.5", int)
+    assert string_is_valid_type("1.5", float)
+    assert string_is_valid_type("-1e-5", float)
+    assert string_is_valid_type(2, float)
+    assert not string_is_valid_type("a", float)
+    assert string_is_valid_type("test1", Literal["test1", "test2"])
+    assert not string_is_valid_type("test3", Literal["test1", "test2"])
+    assert string_is_valid_type("a", Union[int, str])
+    assert string_is_valid_type("1", Union[int, float])
+    assert not string_is_valid_type("a", Union[int, float])
+
+
+def test_compiled_validators():
+    assert compile_validator(Literal["a", "b"]) is compile_validator(Literal["a", "b"])
+    assert MyParams.schema().validators["seed"]("12")
+    assert validate_many(["1", "2", "a", "1", 1.0, 1], int) == [True, True, False, True, False, True]
+
+
 def test_as_output():
     assert MyParams4.as_output() == r"{seed,\d+}/{name,\w+}/file.npz"
 
@@ -136,7 +157,8 @@ class ParamsWithHierarchcicalUnion:
 
 def test_union_and_hierarchical():
     assert ParamsWithHierarchcicalUnion.parameters == ["name", "config", "ending"]
-    assert ParamsWithHierarchcicalUnion.as_output() == r"{name,\w+}/{config_unknown_union_params,.*}/{ending,\w+}"
+    assert ParamsWithHierarchcicalUnion.as_output() == \
+        r"{name,\w+}/{config_unknown_union_params,(?:(?:[+-]?([0-9]*[.])?[0-9]+)/(?:\d+)|(?:\d+)/(?:\d+)/(?:\d+))}/{ending,\w+}"
 
 
 def test_as_output_with_arguments():
@@ -144,6 +166,30 @@ def test_as_output_with_arguments():
     assert ParamsB.as_output(y=10) == r"{x,\d+}/10/{z,\d+}"
 
 
+def test_as_output_uses_schema_validators(monkeypatch):
+    import snakehelp.snakehelp
+    MyParams4.schema()
+
+    def compile_validator(type):
+        raise AssertionError("as_output should use the validators of the schema")
+
+    monkeypatch.setattr(snakehelp.snakehelp, "compile_validator", compile_validator)
+    assert MyParams4.as_output(seed=[1, 2], name="a") == ["1/a/file.npz", "2/a/file.npz"]
+    with pytest.raises(AssertionError):
+        MyParams4.as_output(seed="a")
+
+
+@parameters
+class ParamsWithShard:
+    shard: int = 0
+    name: str = "a"
+
+
+def test_as_output_with_parameter_named_shard():
+    assert ParamsWithShard.as_output(shard=[1, 2], name="b") == ["1/b", "2/b"]
+    assert list(ParamsWithShard.iter_output(shard=3)) == [r"3/{name,\w+}"]
+
+
 def test_minimal_parameters():
     assert MyParams4.parameters == ["seed", "name", "file"]
     assert MyParams4.minimal_parameters == ["seed", "name"]
@@ -222,6 +268,27 @@ class SomeResult:
     config: str = "test"
 
 
+def test_store_array_result(data_folder):
+    import numpy as np
+    p = Parent(param1=Child(type="array"))
+    p.store_result(np.arange(10))
+    assert open(p.file_path(), "rb").read(6) == b"\x93NUMPY"
+
+    fetched = p.fetch_result()
+    assert np.array_equal(fetched, np.arange(10))
+
+    mapped = p.fetch_result(mmap=True)
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(mapped, np.arange(10))
+    with pytest.raises(ValueError):
+        mapped[0] = 1
+
+    # scalars are still stored as text
+    p.store_result(0.5)
+    assert open(p.file_path()).read() == "0.5"
+    assert p.fetch_result(mmap=True) == 0.5
+
+
 def test_result_decorator():
     assert SomeResult("test").file_path() == "test/SomeResult.txt"
 
@@ -246,7 +313,7 @@ class UnionData:
 
 def test_union_with_shared_subparams():
     path = UnionData.path()
-    correct = "{source,\w+}/{data_unknown_union_params,.*}/{d,\w+}"
+    correct = r"{source,\w+}/{data_unknown_union_params,(?:(?:\d+)/(?:\d+)|(?:[+-]?([0-9]*[.])?[0-9]+))}/{d,\w+}"
     assert path == correct
 
 
@@ -273,10 +340,26 @@ class UnionData2:
 
 def test_union_with_shared_params_at_start_and_end():
     path = UnionData2.path()
-    correct = "{source,\w+}/{some_data_unknown_union_params,.*}/{some_end,\w+}/{d,\w+}"
+    correct = r"{source,\w+}/{some_data_unknown_union_params,(?:(?:\d+)/(?:\d+)|(?:[+-]?([0-9]*[.])?[0-9]+))}/{some_end,\w+}/{d,\w+}"
     assert path == correct
 
 
+def test_union_type_to_regex_is_exact():
+    import re
+    regex = re.compile(type_to_regex(Union[ParamsA, ParamsB]))
+    assert regex.fullmatch("0.5/3")
+    assert regex.fullmatch("1/2/3")
+    assert not regex.fullmatch("1/x")
+    assert not regex.fullmatch("a/b/c")
+    assert not regex.fullmatch("1/2/3/4")
+
+
+def test_sequences_to_regex_shares_prefixes():
+    from snakehelp.snakehelp import sequences_to_regex
+    assert sequences_to_regex([["a", "b"], ["a", "c"]]) == "(?:a)(?:/(?:b)|/(?:c))"
+    assert sequences_to_regex([["a"], ["a", "c"]]) == "(?:a)(?:/(?:c))?"
+
+
 def test_union_choices():
     UnionData2.limit_union_choice('RealData2')
     fields = UnionData2.get_fields()
@@ -357,6 +440,10 @@ def test_replace_field():
     print(new.fields())
     types = [f.type for f in new.get_fields()]
     assert types == [int, int, int, int]
+    # classes made by replace_field are not registered, they have the same name as the original
+    from snakehelp import registered_classes
+    assert new not in registered_classes()
+    assert SomeType in registered_classes()
 
 
 @result
@@ -368,3 +455,169 @@ def test_result_type():
     assert isinstance(SomeResult("test"), ResultLike)
     assert issubclass(SomeResult, ResultLike)
 
+
+
+def test_schema_is_cached():
+    assert MyParams2.schema() is MyParams2.schema()
+    assert MyParams2.schema().index["some_other_param"] == 3
+    assert MyParams4.schema().minimal_parameters == ("seed", "name")
+
+
+def test_schema_is_rebuilt_after_union_choice():
+    UnionData2.clear_union_choices()
+    wrapper_fields = [f.name for f in UnionDataWrapper.get_fields()]
+    assert wrapper_fields == ["some_data", "d", "param1"]
+
+    UnionData2.limit_union_choice("SimulatedData2")
+    wrapper_fields = [f.name for f in UnionDataWrapper.get_fields()]
+    assert wrapper_fields == ["source", "c", "some_end", "d", "param1"]
+    UnionData2.clear_union_choices()
+
+
+def test_result_schema_is_not_shared_with_base():
+    schema = SomeResult.schema()
+    assert SomeResult.__dict__["_schema"] is schema
+    assert SomeResult.parameters == ["test"]
+
+
+def test_as_input_is_cached():
+    func = MyParams4.as_input()
+    wildcards = WildcardMock(seed="1", name="test", other="a")
+    assert func(wildcards) == os.path.sep.join(["1", "test", "file.npz"])
+    # wildcards that are not parameters of the class should not affect the cache key
+    assert func(WildcardMock(seed="1", name="test", other="b")) == os.path.sep.join(["1", "test", "file.npz"])
+    assert func(WildcardMock(seed="2", name="test")) == os.path.sep.join(["2", "test", "file.npz"])
+
+    info = func.cache_info()
+    assert info.hits == 1
+    assert info.misses == 2
+
+
+def test_as_input_follows_union_choices():
+    UnionData2.clear_union_choices()
+    func = UnionData2.as_input()
+    wildcards = WildcardMock(source="sim", c="1", some_end="end", d="x")
+    assert func(wildcards) == UnionData2.as_output(d="x")
+
+    UnionData2.limit_union_choice("SimulatedData2")
+    try:
+        assert func(wildcards) == os.path.sep.join(["sim", "1", "end", "x"])
+    finally:
+        UnionData2.clear_union_choices()
+    assert func(wildcards) == UnionData2.as_output(d="x")
+
+
+def test_as_input_cache_is_bounded():
+    func = MyParams4.as_input(cache_size=2)
+    for seed in range(5):
+        func(WildcardMock(seed=str(seed), name="test"))
+    assert func.cache_info().currsize == 2
+
+
+def test_template():
+    template = MyParams4.template()
+    assert template is MyParams4.template()
+    assert template.slots == ("seed", "name")
+    assert template.render(seed=1, name="test") == MyParams4.as_output(seed=1, name="test")
+
+
+def test_template_render_many():
+    paths = Combinatorial.template().render_many(param1=[1, 2, 3], param2=[4, 5, 6])
+    assert paths == ["1/4", "2/5", "3/6"]
+
+    paths = ParamsWithFileName.template().render_many(param=["a", "b"])
+    assert paths == ["a/test.tmp", "b/test.tmp"]
+
+    # scalars are used for every row
+    assert Combinatorial.template().render_many(param1=[1, 2], param2=7) == ["1/7", "2/7"]
+    import numpy as np
+    assert Combinatorial.template().render_many(param1=[1, 2], param2=np.int64(7)) == ["1/7", "2/7"]
+
+
+def test_template_render_many_invalid():
+    with pytest.raises(AssertionError):
+        Combinatorial.template().render_many(param1=[1, 2], param2=[4])
+
+    with pytest.raises(AssertionError):
+        Combinatorial.template().render_many(param1=[1, "a"], param2=[4, 5])
+
+    with pytest.raises(AssertionError):
+        Combinatorial.template().render_many(param1=[1])
+
+    # 1.0 is equal to 1, but not a valid int
+    with pytest.raises(AssertionError):
+        Combinatorial.template().render_many(param1=[1, 1.0], param2=[4, 5])
+
+
+def test_iter_output():
+    files = Combinatorial.iter_output(param1=[1, 2, 3], param2=[4, 5])
+    assert not isinstance(files, list)
+    assert list(files) == Combinatorial.as_output(param1=[1, 2, 3], param2=[4, 5])
+    assert list(ParamsB.iter_output(y=10)) == [ParamsB.as_output(y=10)]
+
+    # invalid values are reported when calling, not when iterating
+    with pytest.raises(AssertionError):
+        Combinatorial.iter_output(param1=["a"])
+
+
+def test_from_path():
+    o = ParamWithFileEnding(param1="test", param2=3)
+    assert ParamWithFileEnding.from_path(o.file_path()) == o
+    assert isinstance(ParamWithFileEnding.from_path("test/3.txt").param2, int)
+
+    nested = Parent(param1=Child(type="test", ending="file.txt"), param2=3, ending="results.txt")
+    assert Parent.from_path(nested.file_path()) == nested
+
+    with pytest.raises(AssertionError):
+        ParamWithFileEnding.from_path("test/3.csv")
+
+
+def test_from_path_union():
+    assert ParamsWithUnion.from_path("10/a") == ParamsWithUnion(10, "a")
+    assert ParamsWithUnion.from_path("b/a") == ParamsWithUnion("b", "a")
+
+    o = ParamsWithHierarchcicalUnion("test", ParamsB(1, 2, 3), "end")
+    assert ParamsWithHierarchcicalUnion.from_path(o.file_path()) == o
+    o = ParamsWithHierarchcicalUnion("test", ParamsA(0.5, 2), "end")
+    assert ParamsWithHierarchcicalUnion.from_path(o.file_path()) == o
+
+
+def test_from_paths():
+    paths = Combinatorial.as_output(param1=[1, 2, 3], param2=[4, 5]) + ["a/b"]
+    objects = Combinatorial.from_paths(paths, skip_invalid=True)
+    assert len(objects) == 6
+    assert Combinatorial(2, 5) in objects
+
+    with pytest.raises(AssertionError):
+        Combinatorial.from_paths(paths)
+
+
+def test_registry():
+    from snakehelp import registered_classes
+    classes = registered_classes()
+    assert MyParams in classes
+    assert SomeResult in classes
+    # results replace the registration of the parameters class they are made from
+    assert len([c for c in classes if c.__qualname__ == "Precision"]) <= 1
+
+
+def test_wildcard_constraints():
+    from snakehelp import wildcard_constraints, wildcard_constraints_block
+    from snakehelp.registry import conflicting_wildcards
+    constraints = wildcard_constraints([MyParams, MyParams4, ParamsWithUnion])
+    assert constraints == {"seed": r"\d+", "name": r"\w+", "ratio": type_to_regex(float),
+                           "param1": r"\d+|\w+", "param2": r"\w+"}
+
+    # param1 is a Literal in MyParams3, so it can not be constrained globally
+    assert "param1" not in wildcard_constraints([MyParams3, ParamsWithUnion])
+    assert conflicting_wildcards([MyParams3, ParamsWithUnion]) == {"param1": ["test|test2", r"\d+|\w+"]}
+
+    block = wildcard_constraints_block([MyParams4])
+    assert block == "wildcard_constraints:\n    seed='\\\\d+',\n    name='\\\\w+',\n"
+
+
+def test_output_pattern():
+    assert MyParams4.output_pattern() == "{seed}/{name}/file.npz"
+    assert MyParams4.output_pattern(seed=[1, 2]) == ["1/{name}/file.npz", "2/{name}/file.npz"]
+    # param1 and param2 have different regexes in different classes, so the regexes stay inline
+    assert ParamsWithUnion.output_pattern() == ParamsWithUnion.as_output()
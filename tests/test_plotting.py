@@ -1,7 +1,7 @@
 from snakehelp.parameters import parameters, result
 from typing import Literal
 from dataclasses import dataclass
-from snakehelp.plotting import PlotType, Plot
+from snakehelp.plotting import PlotType, Plot, render_plots, render_figure
 import pytest
 
 @parameters
@@ -57,3 +57,145 @@ def test_simple_plot():
 
 
 
+
+
+def test_plot_type_from_yaml_dict():
+    plot_type = PlotType.from_yaml_dict({"type": "bar", "x": "method_name", "y": "MappingRecall"}, [MappingRecall, Method])
+    assert plot_type.y == MappingRecall
+    assert plot_type.x == "method_name"
+
+    # a class made by replace_field has the same name, and is not found among the registered classes
+    derived = MappingRecall.replace_field("n_threads", ("n_threads", int, 8))
+    assert PlotType.from_yaml_dict({"type": "bar", "x": "method_name", "y": "MappingRecall"}).y == MappingRecall
+    with pytest.raises(AssertionError):
+        PlotType.from_yaml_dict({"type": "bar", "x": "method_name", "y": "MappingRecall"}, [MappingRecall, derived])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_plots(tmp_path, workers, data_folder):
+    for i, method_name in enumerate(["bwa", "minimap"]):
+        for read_length in (10, 20):
+            MappingRecall.from_flat_params(method_name=method_name, read_length=read_length).store_result(i + read_length / 100)
+
+    specs = [
+        (PlotType("bar", x="method_name", y=MappingRecall), str(tmp_path / "by_method"), {"method_name": ["bwa", "minimap"]}),
+        (PlotType("line", x="read_length", y=MappingRecall, color="method_name"), str(tmp_path / "by_read_length"),
+         {"method_name": ["bwa", "minimap"], "read_length": [10, 20]}),
+    ]
+    _, rendered = render_plots(specs, workers=workers, formats=("html",))
+    assert rendered == [True, True]
+    for name in ("by_method", "by_read_length"):
+        assert (tmp_path / (name + ".html")).exists()
+        assert (tmp_path / (name + ".txt")).exists()
+    assert (tmp_path / "by_read_length.csv").read_text().splitlines()[1:] == \
+        ["hg38,10,something,bwa,4,0.1", "hg38,20,something,bwa,4,0.2",
+         "hg38,10,something,minimap,4,1.1", "hg38,20,something,minimap,4,1.2"]
+
+    # only plots with changed data are written again
+    MappingRecall.from_flat_params(method_name="bwa", read_length=20).store_result(0.5)
+    assert render_plots(specs, workers=workers, formats=("html",))[1] == [False, True]
+    assert render_plots(specs, workers=workers, formats=("html",))[1] == [False, False]
+    (tmp_path / "by_method.html").unlink()
+    assert render_plots(specs, workers=workers, formats=("html",))[1] == [True, False]
+    assert render_plots(specs, workers=workers, formats=("html",), force=True)[1] == [True, True]
+
+
+def test_plot_skips_unchanged_outputs_when_showing(tmp_path, monkeypatch, data_folder):
+    import plotly.graph_objects as go
+    shown = []
+    monkeypatch.setattr(go.Figure, "show", lambda self, *args, **kwargs: shown.append(self))
+    for method_name in ("bwa", "minimap"):
+        MappingRecall.from_flat_params(method_name=method_name).store_result(0.5)
+
+    plot = PlotType("bar", x="method_name", y=MappingRecall).plot(str(tmp_path / "recall"), method_name=["bwa", "minimap"])
+    assert plot.plot(formats=("html",))
+    (tmp_path / "recall.html").write_text("unchanged")
+    assert not plot.plot(formats=("html",))
+    assert (tmp_path / "recall.html").read_text() == "unchanged"
+    assert len(shown) == 2
+    assert plot.plot(formats=("html",), force=True)
+    assert (tmp_path / "recall.html").read_text() != "unchanged"
+
+
+def test_aggregate(tmp_path, data_folder):
+    for i, method_name in enumerate(["bwa", "minimap"]):
+        for read_length in (10, 20, 30):
+            MappingRecall.from_flat_params(method_name=method_name, read_length=read_length).store_result(i + read_length / 100)
+
+    data = {"method_name": ["bwa", "minimap"], "read_length": [10, 20, 30]}
+    plot_type = PlotType("bar", x="method_name", y=MappingRecall, aggregate="mean")
+    df = Plot(plot_type, str(tmp_path / "mean"), **data).collect()
+    assert "read_length" not in df
+    assert df.method_name.tolist() == ["bwa", "minimap"]
+    assert df.MappingRecall.tolist() == pytest.approx([0.2, 1.2])
+
+    plot_type = PlotType("box", x="method_name", y=MappingRecall, aggregate="quantiles", aggregate_over=["read_length"])
+    df = Plot(plot_type, str(tmp_path / "box"), **data).collect()
+    assert len(df) == 10
+    assert df[df.method_name == "minimap"].MappingRecall.tolist() == pytest.approx([1.1, 1.15, 1.2, 1.25, 1.3])
+
+    with pytest.raises(AssertionError):
+        PlotType("box", x="method_name", y=MappingRecall, aggregate="quantiles", aggregate_over=["method_name"])
+
+
+def test_large_scatter(tmp_path, monkeypatch):
+    import pandas as pd
+    import snakehelp.plotting
+    monkeypatch.setattr(snakehelp.plotting, "LARGE_SCATTER_THRESHOLD", 2)
+    df = pd.DataFrame({"read_length": [10, 20, 30], "MappingRecall": [0.1, 0.2, 0.3]})
+    plot = Plot(PlotType("scatter", x="read_length", y=MappingRecall), str(tmp_path / "scatter"), read_length=[10, 20, 30])
+    render_figure(df, plot.figure_spec(), str(tmp_path / "scatter"), formats=("html",))
+    assert "scattergl" in (tmp_path / "scatter.html").read_text()
+
+    plot = Plot(PlotType("scatter", x="read_length", y=MappingRecall, large_scatter="density"), str(tmp_path / "density"), read_length=[10, 20, 30])
+    render_figure(df, plot.figure_spec(), str(tmp_path / "density"), formats=("html",))
+    assert "histogram2d" in (tmp_path / "density.html").read_text()
+
+
+def test_density_ignores_other_dimensions(tmp_path):
+    import pandas as pd
+    from snakehelp.plotting import make_figure
+    df = pd.DataFrame({"read_length": [10, 20], "method_name": ["bwa", "minimap"], "MappingRecall": [0.1, 0.2]})
+    plot = Plot(PlotType("density", x="read_length", y=MappingRecall, color="method_name", text="method_name"),
+                str(tmp_path / "density"), read_length=[10, 20], method_name=["bwa", "minimap"])
+    fig = make_figure(df, plot.figure_spec())
+    assert fig.data[0].type == "histogram2d"
+
+
+def test_write_report(tmp_path, data_folder):
+    import base64
+    import gzip
+    import json
+    from snakehelp.report import write_report
+    for method_name in ["bwa", "minimap"]:
+        MappingRecall.from_flat_params(method_name=method_name).store_result(0.5)
+
+    plot_type = PlotType("bar", x="method_name", y=MappingRecall)
+    specs = [(plot_type, f"plot{i}", {"method_name": ["bwa", "minimap"]}) for i in range(3)]
+    out = tmp_path / "report.html"
+    write_report(specs, str(out), title="Recall")
+    report = out.read_text()
+
+    # plotly.js is only included once
+    assert report.count("<script>") == 2
+    assert all(f'<section id="plot{i}">' in report for i in range(3))
+
+    tables = json.loads(report.split("const tables = ")[1].split(";\n")[0])
+    table = json.loads(gzip.decompress(base64.b64decode(tables[0])))
+    assert table["columns"][-1] == "MappingRecall"
+    assert [row[-1] for row in table["data"]] == [0.5, 0.5]
+
+
+def test_watch_plot(tmp_path, data_folder):
+    MappingRecall.from_flat_params(method_name="bwa").store_result(0.5)
+    plot = Plot(PlotType("bar", x="method_name", y=MappingRecall), str(tmp_path / "watched"), method_name=["bwa", "minimap"])
+    updates = plot.watch(render_interval=0, interval=0.01, use_inotify=False, timeout=5)
+    df = next(updates)
+    assert df.MappingRecall.isna().tolist() == [False, True]
+    assert (tmp_path / "watched.html").exists()
+
+    MappingRecall.from_flat_params(method_name="minimap").store_result(0.7)
+    for df in updates:
+        pass
+    assert df.MappingRecall.tolist() == [0.5, 0.7]
+    assert "0.7" in (tmp_path / "watched.csv").read_text()
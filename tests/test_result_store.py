@@ -0,0 +1,128 @@
+import os
+import pytest
+from snakehelp import parameters, result, set_result_store
+from snakehelp.parameter_combinations import ParameterCombinations, ResultFetchError
+
+pytest.importorskip("pyarrow")
+from snakehelp.result_store import ParquetResultStore
+
+
+@parameters
+class Simulation:
+    genome: str = "hg38"
+    n_reads: int = 100
+
+
+@result
+class Accuracy:
+    simulation: Simulation
+
+
+@result
+class Name:
+    simulation: Simulation
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ParquetResultStore(str(tmp_path / "results.parquet"), compact_every=3)
+    set_result_store(store)
+    yield store
+    set_result_store(None)
+
+
+def test_store_and_fetch_result(store):
+    Accuracy.from_flat_params(n_reads=10).store_result(0.5)
+    Name.from_flat_params(n_reads=10).store_result("bwa")
+    assert Accuracy.from_flat_params(n_reads=10).fetch_result() == 0.5
+    assert Name.from_flat_params(n_reads=10).fetch_result() == "bwa"
+    assert not os.path.exists(Accuracy.from_flat_params(n_reads=10).file_path())
+
+    # latest value wins
+    Accuracy.from_flat_params(n_reads=10).store_result(0.8)
+    assert Accuracy.from_flat_params(n_reads=10).fetch_result() == 0.8
+
+    with pytest.raises(KeyError):
+        Accuracy.from_flat_params(n_reads=11).fetch_result()
+
+
+def test_compaction(store):
+    for n_reads in range(10):
+        Accuracy.from_flat_params(n_reads=n_reads).store_result(n_reads / 10)
+    Accuracy.from_flat_params(n_reads=0).store_result(1.0)
+
+    assert len(store._fragments("Accuracy")) <= 4
+    store.compact(Accuracy)
+    assert len(store._fragments("Accuracy")) == 1
+
+    df = store.read(Accuracy, n_reads=[0, 5])
+    assert sorted(df.value.tolist()) == [0.5, 1.0]
+
+
+def test_get_results_dataframe_from_store(store):
+    for n_reads in [10, 20]:
+        Accuracy.from_flat_params(n_reads=n_reads).store_result(n_reads / 100)
+        Name.from_flat_params(n_reads=n_reads).store_result("name" + str(n_reads))
+    Accuracy.from_flat_params(genome="hg19", n_reads=10).store_result(1.0)
+
+    combinations = ParameterCombinations(["n_reads"], [Accuracy, Name])
+    df = combinations.get_results_dataframe(n_reads=[10, 20])
+    assert df.genome.tolist() == ["hg38", "hg38"]
+    assert df.Accuracy.tolist() == [0.1, 0.2]
+    assert df.Name.tolist() == ["name10", "name20"]
+
+    with pytest.raises(ResultFetchError):
+        combinations.get_results_dataframe(n_reads=[10, 30])
+
+
+def test_watch_store(store):
+    Accuracy.from_flat_params(n_reads=10).store_result(0.1)
+    updates = ParameterCombinations(["n_reads"], [Accuracy], interval=0.01, timeout=10).watch(n_reads=[10, 20])
+    df = next(updates)
+    assert df.Accuracy.tolist()[0] == 0.1
+    assert df.Accuracy.isna().tolist() == [False, True]
+
+    Accuracy.from_flat_params(n_reads=20).store_result(0.2)
+    for df in updates:
+        pass
+    assert df.Accuracy.tolist() == [0.1, 0.2]
+    # no result files are written when a store is used
+    assert not os.path.exists(Accuracy.from_flat_params(n_reads=20).file_path())
+
+
+def test_store_large_ints_and_ignore_other_data(store):
+    for n_reads in range(5):
+        Accuracy.from_flat_params(n_reads=n_reads).store_result(2 ** 60 + n_reads)
+    Accuracy.from_flat_params(n_reads=5).store_result(0.5)
+    assert [Accuracy.from_flat_params(n_reads=n).fetch_result() for n in range(6)] == [2 ** 60 + n for n in range(5)] + [0.5]
+    assert isinstance(Accuracy.from_flat_params(n_reads=0).fetch_result(), int)
+    # data for parameters that the result type does not have are ignored, as in from_flat_params
+    assert store.read(Accuracy, n_reads=1, read_length=150)["value"].tolist() == [2 ** 60 + 1]
+
+
+def _store_many(folder, start, n):
+    store = ParquetResultStore(folder, compact_every=4)
+    for n_reads in range(start, start + n):
+        store.append(Accuracy.from_flat_params(n_reads=n_reads), n_reads / 1000)
+
+
+def test_parallel_store_with_compaction(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    folder = str(tmp_path / "results.parquet")
+    with ProcessPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(_store_many, folder, start, 50) for start in range(0, 400, 50)]
+        for future in futures:
+            future.result()
+
+    store = ParquetResultStore(folder)
+    store.compact(Accuracy)
+    df = store.read(Accuracy)
+    assert sorted(df.n_reads.tolist()) == list(range(400))
+
+
+def test_store_numpy_scalars(store):
+    import numpy as np
+    Accuracy.from_flat_params(n_reads=1).store_result(np.int64(5))
+    Accuracy.from_flat_params(n_reads=2).store_result(np.float32(0.5))
+    Accuracy.from_flat_params(n_reads=3).store_result(np.float64(0.25))
+    assert [Accuracy.from_flat_params(n_reads=n).fetch_result() for n in (1, 2, 3)] == [5, 0.5, 0.25]